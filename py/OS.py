@@ -5,9 +5,23 @@ from lib.IO import KbdInp
 from lib.API import TerminalAPI
 import lib.core  # noqa: F401 # Imports all the apps which automatically add themselves to the API on definition
 
+MAX_FPS = 30 # The most frames that will be drawn per second; when nothing changes no frames are drawn at all
+KEY_REPEAT_DELAY = 0.5 # How long a key has to be held before it starts repeating, in secs
+KEY_REPEAT_RATE = 25 # How many times a sec a held key repeats
+KBD_IN_PROCESS = False # Read the keyboard device in this process instead of a separate reader process
+STATS_FILE = None # A file to append the performance stats to whenever they're shown (super+ctrl+shift+L)
+PROFILE_FILE = None # A CSV file to write the time every part of every frame took to while profiling (super+ctrl+shift+P)
+
 API = TerminalAPI()
+API.start()
+API.sched.maxFPS = MAX_FPS
+API.statsFile = STATS_FILE
+API.profiler.traceFile = PROFILE_FILE
+API.keyRepeat.delay = KEY_REPEAT_DELAY
+API.keyRepeat.rate = KEY_REPEAT_RATE
+prof = API.profiler
 
-inp = KbdInp()
+inp = KbdInp(KBD_IN_PROCESS, API.keyRepeat, API.sched)
 sys.stdout.write('\033[?25l')
 sys.stdout.flush()
 
@@ -15,16 +29,29 @@ fd = sys.stdin.fileno()
 old_settings = termios.tcgetattr(fd)
 tty.setraw(fd)
 sys.stdout.write('\033[2J\033[H')
-while True:
-    evs = inp.handleQueue()
-    resetCache = 'super+ctrl+shift+B' in evs
-    API.events = evs
+sys.stdout.flush() # Frames are written straight to the terminal, so nothing can be left in here
+API.renderer.querySyncOutput(fd)
+try:
+    while True:
+        API.sched.wait()
+        with prof.section('handleQueue'):
+            evs = inp.handleQueue()
+        resetCache = 'super+ctrl+shift+B' in evs
+        API.events = evs
     
-    API.updateAll()
-    API.resetScreens()
-    API.drawAll()
-    if resetCache:
-        API.printAll()
-    else:
-        API.print()
+        with prof.section('updateAll'):
+            API.updateAll()
+        with prof.section('resetScreens'):
+            API.resetScreens()
+        with prof.section('drawAll'):
+            API.drawAll()
+        with prof.section('print'):
+            if resetCache:
+                API.printAll()
+            else:
+                API.print()
+        prof.endFrame()
+finally: # Give the terminal back how it was, even if something went wrong
+    termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
+    sys.stdout.write('\033[0m\033[?25h\n')
     sys.stdout.flush()
@@ -0,0 +1,154 @@
+"""
+Runs the OS headlessly with scripted key presses and a fake terminal, and prints how it performed as JSON.
+
+Usage: `python bench.py [--scenario NAME] [--frames N] [--panes N] [--size WxH] [--lines N] [--out FILE]`
+With no scenario, every scenario is run (each in its own process) and the results are printed together.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from evdev import ecodes
+from lib.IO import KbdInp, Key, KeyChord, KeyRepeat
+from lib.API import TerminalAPI
+from lib.widgets import Terminal
+
+SCENARIOS = ['layout', 'textinput', 'document', 'terminals']
+
+class ScriptedKbd(KbdInp):
+    """Gives out a list of frames of key events in place of the real keyboard"""
+    def __init__(self, script):
+        self.events = {}
+        self.script = list(script)
+        self.repeat = KeyRepeat()
+        self.sched = None
+        self._deferred = []
+
+    def _recv(self):
+        return self.script.pop(0) if self.script else []
+
+def key(txt, state=1):
+    chord = KeyChord.parse(txt)
+    return Key(ecodes.ecodes['KEY_'+chord.key], state, chord.mods)
+
+def presses(*chords):
+    """Gets a script that presses each chord on a frame and lets it go on the next"""
+    script = []
+    last = None
+    for txt in chords:
+        script.append(([key(last, 0)] if last else []) + [key(txt)])
+        last = txt
+    if last:
+        script.append([key(last, 0)])
+    return script
+
+def typing(text):
+    names = {' ': 'SPACE', '.': 'DOT', ',': 'COMMA'}
+    return presses(*[names.get(ch, ch.upper()) for ch in text])
+
+def splits(panes):
+    """Gets the layout editor key presses that split the screen into about `panes` panes"""
+    chords = ['super+A']
+    for idx in range(panes-1):
+        chords.append('ctrl+D' if idx % 2 == 0 else 'ctrl+S')
+    return chords + ['ESC']
+
+def scenario(API, name, args):
+    import lib.core as core
+    if name == 'layout':
+        return presses(*splits(args.panes))
+    if name == 'textinput':
+        API.grid[0][0] = core.Help()
+        text = 'the quick brown fox jumps over the lazy dog. '*10 # Just under what the text input holds
+        return presses('TAB', 'TAB') + typing(text)
+    if name == 'document':
+        from lib.API import App, StaticPos
+        from lib.widgets import TextInput
+        class Document(App):
+            NAME = 'Document'
+            def __init__(self):
+                super().__init__([TextInput(StaticPos(0, 0), 80, 30, start='the quick brown fox jumps over the lazy dog\n'*args.lines, scroll=True)])
+        API.grid[0][0] = Document()
+        return (typing('the quick brown fox. ')+presses('ENTER', 'UP', 'UP', 'LEFT'))*10
+    if name == 'terminals':
+        flood = os.path.join(tempfile.mkdtemp(), 'flood')
+        with open(flood, 'w') as f:
+            f.write('#!/bin/sh\nexec yes "$(seq -s " " 1 40)"\n') # Terminals run `cmd -i`, so this ignores its arguments
+        os.chmod(flood, 0o755)
+        class Flood(core.TerminalApp):
+            NAME = 'Flood'
+            cmd = flood
+        for evs in presses(*splits(args.panes)): # Set up the layout before timing anything
+            runFrame(API, evs)
+        for row in API.grid:
+            for idx in range(len(row)):
+                row[idx] = Flood()
+        API.screenUpdate()
+        end = time.time()+5
+        while time.time() < end and not all(app.widgets[0].Tscreen.Used() for app in API.allLoadedApps()):
+            runFrame(API, []) # Wait for the commands to start
+        return []
+    raise ValueError(f'Unknown scenario {name}')
+
+def runFrame(API, evs):
+    API.events = evs
+    API.updateAll()
+    API.resetScreens()
+    API.drawAll()
+    API.print()
+
+def run(name, args):
+    size = tuple(int(i) for i in args.size.split('x'))
+    TerminalAPI._querySize = staticmethod(lambda: size)
+    API = TerminalAPI()
+    API.sizeChanged() # The API already has the real size, so make it look again
+    API.renderer.fd = os.open(args.out or os.devnull, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+    inp = ScriptedKbd([])
+    inp.script = scenario(API, name, args)
+    API.renderer.totalBytes = API.renderer.frames = 0
+    frames = max(args.frames, len(inp.script))
+
+    start, cpuStart = time.perf_counter(), time.process_time()
+    for _ in range(frames):
+        runFrame(API, inp.handleQueue())
+    wall, cpu = time.perf_counter()-start, time.process_time()-cpuStart
+    for app in API.allLoadedApps():
+        for widget in app.widgets:
+            if isinstance(widget, Terminal): # Stop the terminals' commands
+                widget.close()
+    return {
+        'frames': frames,
+        'fps': frames/wall,
+        'cpuMsPerFrame': cpu/frames*1000,
+        'bytesPerFrame': API.renderer.totalBytes/frames,
+        'totalBytes': API.renderer.totalBytes,
+        'peakRssKB': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--scenario', choices=SCENARIOS)
+    parser.add_argument('--frames', type=int, default=300, help='The least frames to run (more if the script is longer)')
+    parser.add_argument('--panes', type=int, default=4)
+    parser.add_argument('--size', default='120x40', help='The fake terminal size')
+    parser.add_argument('--lines', type=int, default=10000, help='How many lines of text the document scenario edits')
+    parser.add_argument('--out', help='A file to write everything that would have gone to the terminal to')
+    args = parser.parse_args()
+
+    if args.scenario is not None:
+        out = run(args.scenario, args)
+    else:
+        out = {}
+        for name in SCENARIOS: # Each in its own process, as the API is global and peak RSS only goes up
+            cmd = [sys.executable, __file__, '--scenario', name, '--frames', str(args.frames), '--panes', str(args.panes), '--size', args.size, '--lines', str(args.lines)]
+            out[name] = json.loads(subprocess.check_output(cmd))
+    print(json.dumps(out, indent=2))
+    sys.stdout.flush()
+    os._exit(0) # The terminal widgets' processes and queues can hang a normal exit
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,19 @@
-from lib.IO import Key
+from lib.IO import Key, KeyBindings, KeyRepeat
+from lib.sched import Scheduler
+from lib.render import Renderer
+from lib.profiler import Profiler
+from lib.layout import Geometry
+from lib.textbuf import GapBuffer
+import lib.sgr as sgr
+import lib.stats as stats
+import lib.vt as vt
+from array import array
+from collections import deque
+import functools
 from enum import IntEnum
 import math
 import re
-import sys
+import signal
 import time
 import shutil
 
@@ -89,40 +100,247 @@ class Row(list):
             return Row(super().__getitem__(idx))
         return super().__getitem__(idx)
 
+# One Chr is shared between every use of the same styled character, so laying out the same text again doesn't make new ones
+_internChr = functools.lru_cache(maxsize=4096)(Chr)
+
 _SPL_REGEX = re.compile(r'\n|(?:(?:\x1B[@-_][0-?]*[ -/]*[@-~])*.?)')
 def SPL(txt):
-    return [i if len(i) == 1 else Chr(i) for i in _SPL_REGEX.findall(txt) if i]
+    if '\033' not in txt: # Every character is on its own
+        return list(txt)
+    return [i if len(i) == 1 else _internChr(i) for i in _SPL_REGEX.findall(txt) if i]
+
+class Cell:
+    """A view of one cell of a Screen. Like Chr, use it as a normal string."""
+    __slots__ = ('chr', 'style')
+    def __init__(self, chr, style=sgr.DEFAULT):
+        self.chr = chr
+        self.style = style
+    
+    def __getitem__(self, idx):
+        if idx == -1:
+            return self.chr
+        return str(self)[idx]
+    
+    def __len__(self):
+        return 1
+    
+    def __eq__(self, other):
+        if isinstance(other, Cell):
+            return self.chr == other.chr and self.style == other.style
+        return str(self) == other
+    
+    def __hash__(self):
+        return hash((self.chr, self.style))
+    
+    def __str__(self):
+        return sgr.encode(self.style)+self.chr
+    def __repr__(self):
+        return str(self)
+
+_ESC_SPLIT_REGEX = re.compile(r'(\x1B[@-_][0-?]*[ -/]*[@-~])')
+def _codepoints(txt):
+    arr = array('I')
+    arr.frombytes(txt.encode('utf-32-le'))
+    return arr
+
+@functools.lru_cache(maxsize=1024)
+def _styledRuns(txt):
+    """Splits text with escape sequences in it into runs of (codepoints, style). The same strings (borders, labels, help text) get written every frame, so these are cached."""
+    runs = []
+    style = sgr.DEFAULT
+    for idx, part in enumerate(_ESC_SPLIT_REGEX.split(txt)):
+        if idx % 2:
+            style = sgr.apply(style, part)
+        elif part:
+            runs.append((_codepoints(part), style))
+    return tuple(runs), style
+
+class Cells:
+    """Cells copied from a screen (see `Screen.Cells`), which `Screen.Write` can write as they are instead of them being turned into text and parsed again"""
+    __slots__ = ('chars', 'styles')
+    def __init__(self, chars, styles):
+        self.chars = chars
+        self.styles = styles
+    
+    def __len__(self):
+        return len(self.chars)
 
 class Screen:
-    def __init__(self):
-        self.Clear()
+    """A fixed size grid of cells, stored as flat arrays of codepoints and style ids (see `lib.sgr`)"""
+    def __init__(self, width=0, height=0):
+        self.width, self.height = max(width, 0), max(height, 0)
+        self._blank = array('I', [32])*(self.width*self.height)
+        self._zeros = array('I', [sgr.DEFAULT])*(self.width*self.height)
+        self.chars = array('I', self._blank)
+        self.styles = array('I', self._zeros)
+        self.lengths = array('I', [0])*self.height # How far along each row has been written to
     
     def Clear(self):
-        self.screen = {}
+        self.chars[:] = self._blank
+        self.styles[:] = self._zeros
+        self.lengths[:] = array('I', [0])*self.height
     
-    def Write(self, x, y, *args):
-        """Writes "".join(args) at (x, y)"""
-        t = "".join(args)
-        if t == '' or y < 0:
-            return
+    def Resize(self, width, height):
+        """Resizes the screen, keeping whatever fits in the new size"""
+        w, h, chars, styles, lengths = self.width, self.height, self.chars, self.styles, self.lengths
+        Screen.__init__(self, width, height)
+        cpy = min(w, self.width)
+        for y in range(min(h, self.height)):
+            self.chars[y*self.width:y*self.width+cpy] = chars[y*w:y*w+cpy]
+            self.styles[y*self.width:y*self.width+cpy] = styles[y*w:y*w+cpy]
+            self.lengths[y] = min(lengths[y], self.width)
+    
+    def _Row(self, y):
+        """Gets where row y is stored"""
+        return y
+    
+    def _Off(self, y):
+        return self._Row(y)*self.width
+    
+    def _WriteRun(self, x, y, txt, style):
+        """Writes a run of text all in the one style, returning the x position after it"""
+        end = x+len(txt)
+        if x >= self.width: # All of it is off the right edge
+            return end
         if x < 0:
-            t = t[-x:]
+            txt = txt[-x:]
             x = 0
-        spl = SPL(t)
-        if y in self.screen:
-            if len(self.screen[y]) >= x:
-                self.screen[y] = self.screen[y][:x] + spl + self.screen[y][x+len(spl):]
+        if end > self.width:
+            txt = txt[:self.width-x]
+        if txt:
+            off = y*self.width+x
+            self.chars[off:off+len(txt)] = txt if type(txt) is array else _codepoints(txt)
+            self.styles[off:off+len(txt)] = array('I', [style])*len(txt)
+            if x+len(txt) > self.lengths[y]:
+                self.lengths[y] = x+len(txt)
+        return end
+    
+    def Write(self, x, y, *args):
+        """Writes "".join(args) at (x, y). Any args that are `Cells` get written as they are, with their styles on top of the style before them."""
+        if y < 0 or y >= self.height:
+            return
+        style = sgr.DEFAULT
+        text = []
+        for arg in args:
+            if type(arg) is Cells:
+                x, style = self._WriteText(x, y, ''.join(text), style)
+                x, style = self._WriteCells(x, y, arg, style)
+                text = []
             else:
-                self.screen[y] += [' ']*(x-len(self.screen[y])) + spl
-        else:
-            self.screen[y] = Row(' '*x)+spl
+                text.append(str(arg))
+        self._WriteText(x, y, ''.join(text), style)
+    
+    def _WriteText(self, x, y, t, style):
+        """Writes text with escape sequences in it starting with the pen at `style`, returning the x and style after it"""
+        if '\033' not in t:
+            return (self._WriteRun(x, y, t, style) if t else x), style
+        if style == sgr.DEFAULT:
+            runs, end = _styledRuns(t)
+            for chars, st in runs:
+                x = self._WriteRun(x, y, chars, st)
+            return x, end
+        for idx, part in enumerate(_ESC_SPLIT_REGEX.split(t)):
+            if idx % 2:
+                style = sgr.apply(style, part)
+            elif part:
+                x = self._WriteRun(x, y, part, style)
+        return x, style
+    
+    def _WriteCells(self, x, y, cells, style):
+        """Writes `Cells` the same as writing the text `Line` would give for them, returning the x and style after it"""
+        src = sgr.DEFAULT
+        start, n = 0, len(cells)
+        while start < n:
+            st = cells.styles[start]
+            end = start+1
+            while end < n and cells.styles[end] == st:
+                end += 1
+            if st != src:
+                style = sgr.apply(style, sgr.transition(src, st))
+                src = st
+            x = self._WriteRun(x, y, cells.chars[start:end], style)
+            start = end
+        if src != sgr.DEFAULT:
+            style = sgr.apply(style, sgr.transition(src, sgr.DEFAULT))
+        return x, style
+    
+    def Blit(self, src, x, y, clip=None):
+        """
+        Copies everything that's been written on the screen `src` onto this one, with its top left at (x, y).
+        `clip` can give the x each row of this screen stops at, for when something else will cover the rest.
+        """
+        start = max(-x, 0)
+        for sy in src.Used():
+            if not 0 <= y+sy < self.height:
+                continue
+            end = min(src.Length(sy), self.width-x)
+            if clip is not None:
+                end = min(end, clip[y+sy]-x)
+            if end <= start:
+                continue
+            srcOff, dstOff = src._Off(sy), self._Off(y+sy)+x
+            self.chars[dstOff+start:dstOff+end] = src.chars[srcOff+start:srcOff+end]
+            self.styles[dstOff+start:dstOff+end] = src.styles[srcOff+start:srcOff+end]
+            row = self._Row(y+sy)
+            if x+end > self.lengths[row]:
+                self.lengths[row] = x+end
+    
+    def Restyle(self, x, y, width, seq):
+        """Applies the escape sequence `seq` on top of the style of the `width` cells from (x, y)"""
+        if y < 0 or y >= self.height:
+            return
+        off = y*self.width
+        for x2 in range(max(x, 0), min(x+width, self.width)):
+            self.styles[off+x2] = sgr.apply(self.styles[off+x2], seq)
     
     def Get(self, x, y):
         """Gets the character at (x, y)"""
-        if y in self.screen:
-            if len(self.screen[y]) > x:
-                return self.screen[y][x]
-        return ' '
+        if 0 <= x < self.width and 0 <= y < self.height:
+            off = y*self.width+x
+            return Cell(chr(self.chars[off]), self.styles[off])
+        return Cell(' ')
+    
+    def Length(self, y):
+        """Gets how far along row y has been written to"""
+        return self.lengths[y]
+    
+    def Used(self):
+        """Gets all the rows that have been written to"""
+        return [y for y in range(self.height) if self.lengths[y]]
+    
+    def SameRow(self, other, y):
+        """Checks whether row y of this screen is the same as row y of `other`"""
+        if self.width != other.width:
+            return False
+        off, otherOff = self._Off(y), other._Off(y) # Either could keep its rows in a ring
+        return self.chars[off:off+self.width] == other.chars[otherOff:otherOff+self.width] and \
+               self.styles[off:off+self.width] == other.styles[otherOff:otherOff+self.width]
+    
+    def Line(self, y, start=0, end=None):
+        """Gets the text of row y from `start` to `end` (defaults to the end of what has been written), with the escape sequences to style it"""
+        if end is None:
+            end = self.lengths[y]
+        off = y*self.width
+        txt = self.chars[off+start:off+end].tobytes().decode('utf-32-le')
+        styles = self.styles[off+start:off+end]
+        if styles.count(sgr.DEFAULT) == len(styles):
+            return txt
+        out = []
+        style = sgr.DEFAULT
+        for idx, c in enumerate(txt):
+            if styles[idx] != style:
+                out.append(sgr.transition(style, styles[idx]))
+                style = styles[idx]
+            out.append(c)
+        out.append(sgr.transition(style, sgr.DEFAULT))
+        return ''.join(out)
+    
+    def Cells(self, y, start=0, end=None):
+        """Gets row y from `start` to `end` (defaults to the end of what has been written) as `Cells`, to write somewhere else without going through text"""
+        if end is None:
+            end = self.lengths[y]
+        off = y*self.width
+        return Cells(self.chars[off+start:off+end], self.styles[off+start:off+end])
 
 class Cursor:
     def __init__(self, terminal, x=0, y=0):
@@ -140,112 +358,432 @@ class Cursor:
         if index not in (0, 1):
             raise IndexError(f'Index {index} not in range 0-1!')
 
-        max_val = [self.terminal.width, self.terminal.height][index]
+        max_val = max([self.terminal.width, self.terminal.height][index]-1, 0)
         if not (0 <= value <= max_val):
             raise ValueError(f'Cursor item {index} must be between 0-{max_val}, found {value}!')
 
         self._values[index] = value
 
-_TERMINAL_REGEX = re.compile(r'(?:\x1B[@-_][0-?]*[ -/]*[@-~])|\n|.')
+_PLAIN_LINES = re.compile(r'(?:[^\x00-\x1f\x7f-\x9f]*\r\n)+') # Lines with nothing but text in them, like most floods of output
+_NO_RUNS = array('I') # Shared by all the scrollback lines that are all in the default style
+_SCROLLBACK_OVERHEAD = 100 # Roughly how many bytes each scrollback line takes on top of its text and runs (the tuple, bytes and array objects)
 class TerminalScreen(Screen):
-    def __init__(self, width, height):
-        self.width = width
-        self.height = height
+    """
+    The screen of a terminal emulator. Text written with WriteAtCur is parsed as a VT100/xterm stream by `lib.vt`.
+
+    The rows are stored as a ring starting at `self.origin`, so scrolling the whole screen is just moving that along.
+    Rows that scroll off the top are kept in `self.scrollback` as (UTF-8 text, style runs), until they take up more than `scrollback` bytes.
+    """
+    def __init__(self, width, height, scrollback=1 << 20):
+        super().__init__(width, height)
+        self.origin = 0
+        self.scrollback = deque()
+        self.scrollbackLimit = scrollback
+        self.scrollbackSize = 0
         self.cursor = Cursor(self)
-        super().__init__()
+        self.parser = vt.Parser(self)
+        self.mainScreen = None # What was on the main screen while the alternate screen is up
+        self._Reset()
+    
+    def _Reset(self):
+        self.style = sgr.DEFAULT
+        self.cursorVisible = True
+        self.autowrap = True
+        self.wrapNext = False # The last column has been written to, so the next character starts a new line
+        self.top, self.bottom = 0, max(self.height-1, 0) # The scroll region
+        self.saved = (0, 0, sgr.DEFAULT) # From DECSC
 
+    def _Row(self, y):
+        return (self.origin+y) % self.height if self.height else y
+    
+    def _Unroll(self):
+        """Stores the rows in order again, for the things that work on the arrays directly"""
+        if self.origin:
+            off = self.origin*self.width
+            self.chars[:] = self.chars[off:]+self.chars[:off]
+            self.styles[:] = self.styles[off:]+self.styles[:off]
+            self.lengths[:] = self.lengths[self.origin:]+self.lengths[:self.origin]
+            self.origin = 0
+    
+    # The Screen methods, but with rows where they're stored in the ring
+    def Clear(self):
+        super().Clear()
+        self.origin = 0
+    
+    def _WriteRun(self, x, y, txt, style):
+        return super()._WriteRun(x, self._Row(y), txt, style) if 0 <= y < self.height else x+len(txt)
+    
+    def Restyle(self, x, y, width, seq):
+        if 0 <= y < self.height:
+            super().Restyle(x, self._Row(y), width, seq)
+    
+    def Get(self, x, y):
+        return super().Get(x, self._Row(y)) if 0 <= y < self.height else Cell(' ')
+    
+    def Length(self, y):
+        return self.lengths[self._Row(y)]
+    
+    def Used(self):
+        return [y for y in range(self.height) if self.lengths[self._Row(y)]]
+    
+    def Line(self, y, start=0, end=None):
+        return super().Line(self._Row(y), start, end)
+    
+    def Cells(self, y, start=0, end=None):
+        return super().Cells(self._Row(y), start, end)
+    
+    def Resize(self, width, height):
+        self._Unroll()
+        super().Resize(width, height)
+        if self.mainScreen is not None:
+            self.mainScreen.Resize(width, height)
+        self.cursor[0] = min(self.cursor[0], max(width-1, 0))
+        self.cursor[1] = min(self.cursor[1], max(height-1, 0))
+        self.top, self.bottom = 0, max(height-1, 0)
+        self.wrapNext = False
+    
+    def WriteAtCur(self, *args):
+        """Writes "".join(args) at self.cursor, moving self.cursor along. Escape sequences can be split between calls."""
+        self.parser.feed("".join(args))
+    
+    def WriteJumping(self, txt):
+        """
+        Writes like WriteAtCur, but jump scrolls: runs of plain lines that scroll up from the bottom are put straight where they end up,
+        so lines that would only pass through the screen go right into the scrollback. For catching up on floods of output.
+        """
+        pos = 0
+        while True:
+            match = _PLAIN_LINES.search(txt, pos)
+            if not match:
+                break
+            self.parser.feed(txt[pos:match.start()])
+            if self._CanJump():
+                self._JumpLines(match.group().split('\r\n')[:-1])
+                pos = match.end()
+            else: # Go through the first line normally, which usually leaves the cursor where the rest can jump
+                pos = txt.index('\r\n', match.start())+2
+                self.parser.feed(txt[match.start():pos])
+        self.parser.feed(txt[pos:])
+    
+    def _CanJump(self):
+        """Whether the cursor is at the start of a blank bottom row with the whole screen scrolling, which is where _JumpLines starts from"""
+        cur = self.cursor._values
+        return (self.parser.state == vt.GROUND and self.width and self.autowrap and not self.wrapNext and
+                cur[0] == 0 and cur[1] == self.height-1 and self.top == 0 and self.bottom == self.height-1 and
+                self.lengths[self._Row(cur[1])] == 0)
+    
+    def _JumpLines(self, lines):
+        """Does what writing each line then CR LF would, but only writes the rows that are still on the screen at the end"""
+        rows = []
+        for line in lines:
+            rows.extend([line[i:i+self.width] for i in range(0, len(line), self.width)] or [''])
+        shown = min(len(rows), self.height-1) # The bottom row is left blank for the cursor
+        self._Scroll(shown, 0, self.height-1)
+        if self.mainScreen is None:
+            for row in rows[:len(rows)-shown]:
+                self._AddScrollback(row.encode(), array('I', [len(row), self.style]) if row and self.style != sgr.DEFAULT else _NO_RUNS)
+        for y, row in enumerate(rows[len(rows)-shown:], self.height-1-shown):
+            self._WriteRun(0, y, row, self.style)
+    
+    # The cursor is moved through its list in the hot paths, as these already keep it in range and Cursor's checks add up
+    def _MoveTo(self, x, y):
+        cur = self.cursor._values
+        cur[0] = min(max(x, 0), max(self.width-1, 0))
+        cur[1] = min(max(y, 0), max(self.height-1, 0))
+        self.wrapNext = False
+    
+    def _Blank(self, start, end):
+        """Blanks the cells from the flat index `start` to `end`, which must be in one row"""
+        self.chars[start:end] = self._blank[:end-start]
+        self.styles[start:end] = self._zeros[:end-start]
+        row = start//self.width if self.width else 0
+        if end-row*self.width >= self.lengths[row]:
+            self.lengths[row] = min(self.lengths[row], start-row*self.width)
+    
+    def _BlankRow(self, y):
+        off = self._Off(y)
+        self.chars[off:off+self.width] = self._blank[:self.width]
+        self.styles[off:off+self.width] = self._zeros[:self.width]
+        self.lengths[self._Row(y)] = 0
+    
+    def _CopyRow(self, src, dst):
+        srcOff, dstOff = self._Off(src), self._Off(dst)
+        self.chars[dstOff:dstOff+self.width] = self.chars[srcOff:srcOff+self.width]
+        self.styles[dstOff:dstOff+self.width] = self.styles[srcOff:srcOff+self.width]
+        self.lengths[self._Row(dst)] = self.lengths[self._Row(src)]
+    
+    def _Scroll(self, n, top, bottom):
+        """Scrolls rows top to bottom (inclusive) up by n, or down if n is negative"""
+        n = max(min(n, bottom-top+1), -(bottom-top+1))
+        if n == 0 or self.width == 0:
+            return
+        if top == 0 and bottom == self.height-1: # The whole screen, so just turn the ring
+            for _ in range(abs(n)):
+                if n > 0:
+                    if self.mainScreen is None:
+                        self._SaveLine(0)
+                    self.origin = (self.origin+1) % self.height
+                    self._BlankRow(self.height-1)
+                else:
+                    self.origin = (self.origin-1) % self.height
+                    self._BlankRow(0)
+        elif n > 0:
+            for y in range(top, bottom+1-n):
+                self._CopyRow(y+n, y)
+            for y in range(bottom+1-n, bottom+1):
+                self._BlankRow(y)
+        else:
+            for y in range(bottom, top-n-1, -1):
+                self._CopyRow(y+n, y)
+            for y in range(top, top-n):
+                self._BlankRow(y)
+    
+    def _SaveLine(self, y):
+        """Puts row y in the scrollback, stored as its UTF-8 text and a flat array of (run length, style) pairs"""
+        if self.scrollbackLimit <= 0:
+            return
+        off, length = self._Off(y), self.lengths[self._Row(y)]
+        txt = self.chars[off:off+length].tobytes().decode('utf-32-le').encode()
+        styles = self.styles[off:off+length]
+        runs = _NO_RUNS
+        if styles.count(sgr.DEFAULT) != length:
+            runs = array('I')
+            start = 0
+            for x in range(1, length+1):
+                if x == length or styles[x] != styles[start]:
+                    runs.append(x-start)
+                    runs.append(styles[start])
+                    start = x
+        self._AddScrollback(txt, runs)
+    
+    def _AddScrollback(self, txt, runs):
+        self.scrollback.append((txt, runs))
+        self.scrollbackSize += _SCROLLBACK_OVERHEAD+len(txt)+runs.itemsize*len(runs)
+        while self.scrollbackSize > self.scrollbackLimit:
+            old, oldRuns = self.scrollback.popleft()
+            self.scrollbackSize -= _SCROLLBACK_OVERHEAD+len(old)+oldRuns.itemsize*len(oldRuns)
+    
+    def ScrollbackLine(self, idx):
+        """Gets the text of line `idx` of the scrollback (0 is the oldest), with the escape sequences to style it"""
+        txt, runs = self.scrollback[idx]
+        txt = txt.decode()
+        if not runs:
+            return txt
+        out = []
+        style = sgr.DEFAULT
+        pos = 0
+        for i in range(0, len(runs), 2):
+            out.append(sgr.transition(style, runs[i+1]))
+            style = runs[i+1]
+            out.append(txt[pos:pos+runs[i]])
+            pos += runs[i]
+        out.append(sgr.transition(style, sgr.DEFAULT))
+        return ''.join(out)
+    
+    def _LineFeed(self):
+        cur = self.cursor._values
+        if cur[1] == self.bottom:
+            self._Scroll(1, self.top, self.bottom)
+        elif cur[1] < self.height-1:
+            cur[1] += 1
+    
+    def _ReverseIndex(self):
+        if self.cursor[1] == self.top:
+            self._Scroll(-1, self.top, self.bottom)
+        elif self.cursor[1] > 0:
+            self.cursor[1] -= 1
+    
     def incrCursor1(self):
+        """Moves the cursor to the start of the next line, scrolling if it's at the bottom"""
         self.cursor[0] = 0
-        if self.cursor[1]+1 > self.height:
-            self.screen = {i-1: j for i, j in self.screen.items() if i > 0}
-            self.cursor[1] = self.height
-        else:
-            self.cursor[1] += 1
+        self._LineFeed()
     
-    @staticmethod
-    def cursorSetItem(self, curSelf, idx, it):
-        if not isinstance(idx, int):
-            raise TypeError(
-                'Cursor indices must be integers, not '+type(idx).__name__
-            )
-        if not isinstance(it, int):
-            raise TypeError(
-                'Cursor items must be integers, not '+type(it).__name__
-            )
-        if idx != 0 and idx != 1:
-            raise IndexError(
-                f'Index {idx} not in range 0-1!'
-            )
-        mx = [self.width, self.height][curSelf[idx]]
-        if it < 0 or it > mx:
-            raise ValueError(
-                f'Cursor item {idx} must be between 0-{mx}, found {it}!'
-            )
-        self._setCur(curSelf, idx, it)
-    
-    def _ProcessEscape(self, seq):
-        command = seq[-1]
-        if command == 'm': # Is colour sequence, can just write
-            self._Write_SPL(*self.cursor, [Chr(seq+str(self.Get(*self.cursor)))])
+    def _SwitchScreen(self, alt):
+        if alt == (self.mainScreen is not None):
             return
-        args = seq[2:-1]
-        arg_list = [int(arg) if arg.isdigit() else 1 for arg in args.split(';')] if args else []
-
-        if command in ('H', 'f'):
-            # Set cursor position. ANSI coordinates are 1-indexed.
-            row = (arg_list[0] - 1) if len(arg_list) >= 1 else 0
-            col = (arg_list[1] - 1) if len(arg_list) >= 2 else 0
-            self.cursor = [row, col]
-        elif command == 'A':  # Cursor up.
-            n = arg_list[0] if arg_list else 1
-            self.cursor[0] = max(0, self.cursor[0] - n)
-        elif command == 'B':  # Cursor down.
-            n = arg_list[0] if arg_list else 1
-            self.cursor[0] += n
-        elif command == 'C':  # Cursor forward (right).
-            n = arg_list[0] if arg_list else 1
-            self.cursor[1] += n
-        elif command == 'D':  # Cursor backward (left).
-            n = arg_list[0] if arg_list else 1
-            self.cursor[1] = max(0, self.cursor[1] - n)
-        elif command == 'J':
-            # Erase in display. CSI 2J typically clears the entire screen.
-            if arg_list and arg_list[0] == 2:
-                self.Clear()
-        elif command == 'K':
-            # Erase in line. Typically erases from the cursor to the end of the line.
-            self.screen[self.cursor[1]] = self.screen[self.cursor[1]][:self.cursor[0]]
+        self._Unroll()
+        if alt:
+            self.mainScreen = Screen(self.width, self.height)
+            self.mainScreen.chars[:], self.mainScreen.styles[:], self.mainScreen.lengths[:] = self.chars, self.styles, self.lengths
+            self.Clear()
         else:
-            pass
+            self.chars[:], self.styles[:], self.lengths[:] = self.mainScreen.chars, self.mainScreen.styles, self.mainScreen.lengths
+            self.mainScreen = None
     
-    def _Write_SPL(self, x, y, spl):
-        if y in self.screen:
-            if len(self.screen[y]) >= x:
-                self.screen[y] = self.screen[y][:x] + spl + self.screen[y][x+len(spl):]
+    # These are called by the parser
+    def text(self, txt):
+        if self.width == 0 or self.height == 0:
+            return
+        cur = self.cursor._values
+        while txt:
+            if self.wrapNext:
+                cur[0] = 0
+                self._LineFeed()
+                self.wrapNext = False
+            x, y = cur
+            part, txt = txt[:self.width-x], txt[self.width-x:]
+            if not self.autowrap and txt: # Everything past the end of the line goes in the last column
+                part, txt = part[:-1]+txt[-1], ''
+            self._WriteRun(x, y, part, self.style)
+            if x+len(part) >= self.width:
+                cur[0] = self.width-1
+                self.wrapNext = self.autowrap
             else:
-                self.screen[y] += [' ']*(x-len(self.screen[y])) + spl
-        else:
-            self.screen[y] = Row(' '*x)+spl
+                cur[0] = x+len(part)
     
-    def WriteAtCur(self, *args):
-        """Writes "".join(args) at self.cursor, moving self.cursor along"""
-        t = "".join(args)
-        if t == '':
+    def execute(self, ch):
+        if ch == '\n' or ch == '\x0b' or ch == '\x0c':
+            self._LineFeed()
+        elif ch == '\r':
+            self.cursor._values[0] = 0
+            self.wrapNext = False
+        elif ch == '\b':
+            self._MoveTo(self.cursor[0]-1, self.cursor[1])
+        elif ch == '\t':
+            self._MoveTo((self.cursor[0]//8+1)*8, self.cursor[1])
+    
+    def escDispatch(self, inter, final):
+        if inter:
+            return # Character sets and the like
+        if final == 'D':
+            self._LineFeed()
+        elif final == 'E':
+            self.execute('\r')
+            self._LineFeed()
+        elif final == 'M':
+            self._ReverseIndex()
+        elif final == '7':
+            self.saved = (self.cursor[0], self.cursor[1], self.style)
+        elif final == '8':
+            x, y, self.style = self.saved
+            self._MoveTo(x, y)
+        elif final == 'c':
+            self._SwitchScreen(False)
+            self._Reset()
+            self.Clear()
+            self._MoveTo(0, 0)
+    
+    def oscDispatch(self, data):
+        pass # Window titles and such don't mean anything here
+    
+    def csiDispatch(self, private, params, inter, final):
+        if private == '?':
+            if final in ('h', 'l'):
+                for p in params:
+                    self._SetMode(p, final == 'h')
             return
-        
-        t = self.Get(*self.cursor)[:-1]+t
-        
-        for match in _TERMINAL_REGEX.findall(t):
-            if match[0] == '\033':
-                self._ProcessEscape(match)
-            elif match == '\n':
-                self.incrCursor1()
+        if private or inter:
+            return
+        if final == 'm': # Colour, changes the pen for everything written after it
+            self.style = sgr.apply(self.style, f'\033[{";".join(map(str, params))}m')
+            return
+        handler = self._CSI.get(final)
+        if handler is not None:
+            n = params[0] if params and params[0] else 1 # Most of these take a count that defaults to 1
+            handler(self, n, params)
+    
+    def _SetMode(self, mode, on):
+        if mode == 25:
+            self.cursorVisible = on
+        elif mode == 7:
+            self.autowrap = on
+        elif mode in (47, 1047):
+            self._SwitchScreen(on)
+        elif mode == 1049: # Also saves the cursor
+            if on:
+                self.escDispatch('', '7')
+                self._SwitchScreen(True)
             else:
-                self._Write_SPL(*self.cursor, [match])
-                if self.cursor[0]+1 > self.width:
-                    self.incrCursor1()
-                else:
-                    self.cursor[0] += 1
+                self._SwitchScreen(False)
+                self.escDispatch('', '8')
+    
+    def _EraseDisplay(self, n, params):
+        mode = params[0] if params else 0
+        x, y = self.cursor
+        off = self._Off(y)
+        if mode == 0:
+            self._Blank(off+x, off+self.width)
+            for y2 in range(y+1, self.height):
+                self._BlankRow(y2)
+        elif mode == 1:
+            for y2 in range(y):
+                self._BlankRow(y2)
+            self._Blank(off, off+x+1)
+        elif mode in (2, 3):
+            self.Clear()
+    
+    def _EraseLine(self, n, params):
+        mode = params[0] if params else 0
+        x, y = self.cursor
+        off = self._Off(y)
+        if mode == 0:
+            self._Blank(off+x, off+self.width)
+        elif mode == 1:
+            self._Blank(off, off+x+1)
+        elif mode == 2:
+            self._Blank(off, off+self.width)
+    
+    def _InsertLines(self, n, params):
+        if self.top <= self.cursor[1] <= self.bottom:
+            self._Scroll(-n, self.cursor[1], self.bottom)
+            self._MoveTo(0, self.cursor[1])
+    
+    def _DeleteLines(self, n, params):
+        if self.top <= self.cursor[1] <= self.bottom:
+            self._Scroll(n, self.cursor[1], self.bottom)
+            self._MoveTo(0, self.cursor[1])
+    
+    def _ShiftChars(self, n):
+        """Moves the rest of the line from the cursor right by n (left if negative), blanking what's left behind"""
+        x, y = self.cursor
+        w = self.width
+        off, row = self._Off(y), self._Row(y)
+        n = max(min(n, w-x), -(w-x))
+        if n > 0:
+            self.chars[off+x+n:off+w] = self.chars[off+x:off+w-n]
+            self.styles[off+x+n:off+w] = self.styles[off+x:off+w-n]
+            self.lengths[row] = min(self.lengths[row]+n, w) if self.lengths[row] > x else self.lengths[row]
+            self._Blank(off+x, off+x+n)
+        elif n < 0:
+            n = -n
+            length = self.lengths[row]
+            self.chars[off+x:off+w-n] = self.chars[off+x+n:off+w]
+            self.styles[off+x:off+w-n] = self.styles[off+x+n:off+w]
+            self._Blank(off+w-n, off+w)
+            self.lengths[row] = max(length-n, x) if length > x else length
+    
+    def _ScrollRegion(self, n, params):
+        top = (params[0] or 1)-1 if params else 0
+        bottom = (params[1] or self.height)-1 if len(params) > 1 else self.height-1
+        if 0 <= top < bottom < self.height:
+            self.top, self.bottom = top, bottom
+            self._MoveTo(0, 0)
+    
+    _CSI = {
+        'A': lambda self, n, p: self._MoveTo(self.cursor[0], max(self.cursor[1]-n, self.top if self.cursor[1] >= self.top else 0)),
+        'B': lambda self, n, p: self._MoveTo(self.cursor[0], min(self.cursor[1]+n, self.bottom if self.cursor[1] <= self.bottom else self.height-1)),
+        'C': lambda self, n, p: self._MoveTo(self.cursor[0]+n, self.cursor[1]),
+        'D': lambda self, n, p: self._MoveTo(self.cursor[0]-n, self.cursor[1]),
+        'E': lambda self, n, p: self._MoveTo(0, min(self.cursor[1]+n, self.bottom if self.cursor[1] <= self.bottom else self.height-1)),
+        'F': lambda self, n, p: self._MoveTo(0, max(self.cursor[1]-n, self.top if self.cursor[1] >= self.top else 0)),
+        'G': lambda self, n, p: self._MoveTo(n-1, self.cursor[1]),
+        '`': lambda self, n, p: self._MoveTo(n-1, self.cursor[1]),
+        'd': lambda self, n, p: self._MoveTo(self.cursor[0], n-1),
+        'H': lambda self, n, p: self._MoveTo((p[1] if len(p) > 1 and p[1] else 1)-1, n-1), # ANSI coordinates are 1-indexed
+        'f': lambda self, n, p: self._MoveTo((p[1] if len(p) > 1 and p[1] else 1)-1, n-1),
+        'J': _EraseDisplay,
+        'K': _EraseLine,
+        'L': _InsertLines,
+        'M': _DeleteLines,
+        '@': lambda self, n, p: self._ShiftChars(n),
+        'P': lambda self, n, p: self._ShiftChars(-n),
+        'X': lambda self, n, p: self._Blank(self._Off(self.cursor[1])+self.cursor[0], self._Off(self.cursor[1])+min(self.cursor[0]+n, self.width)),
+        'S': lambda self, n, p: self._Scroll(n, self.top, self.bottom),
+        'T': lambda self, n, p: self._Scroll(-n, self.top, self.bottom),
+        'r': _ScrollRegion,
+        's': lambda self, n, p: self.escDispatch('', '7'),
+        'u': lambda self, n, p: self.escDispatch('', '8'),
+    }
 
 class Clipboard:
     CLIP = []
@@ -287,14 +825,55 @@ class TerminalAPI:
         self.layout = [[[], None]]
         self.chooseHold = None
         self.grid = [[None]]
+        self._geometry = None # Worked out from the layout and grid when first needed after they change
         self.extras = []
+        self.popups = [] # The (surface, x, y) of each popup being shown this frame
+        self.occluded = None # For each row, the x the popups start covering it from (or None when there are no popups)
         self.selected = None
-        self.searching = ''
+        self.searching = GapBuffer()
         self.searchTxts = {}
         self.bottomTxt = ''
         self.mode = ScreenModes.APPS
-        self.Screen = Screen()
-        self._oldScreen = Screen()
+        self._bindKeys()
+        self._size = None # The terminal size, only looked up again after a SIGWINCH
+        self._resized = False
+        self.Screen = Screen(*self.get_terminal_size())
+        self._oldScreen = Screen(*self.get_terminal_size())
+        self._fullRedraw = True
+        self.renderer = Renderer()
+        self.sched = Scheduler()
+        self.keyRepeat = KeyRepeat(self.sched) # Give this to the KbdInp, so held keys repeat on time and wake the main loop
+        self.latency = stats.histogram('input latency') # From the kernel seeing a key to the frame showing it being written
+        self.statsFile = None # Where to also append the stats when they're shown, if anywhere
+        self.profiler = Profiler()
+    
+    def start(self):
+        """Starts following the terminal's size. Call it from the main thread of the OS itself, as it installs a SIGWINCH handler (which would replace a tool's own)."""
+        signal.signal(signal.SIGWINCH, lambda signum, frame: self.sizeChanged())
+    
+    def sizeChanged(self):
+        """Makes the next frame look up the terminal size again. Safe to call from a signal handler."""
+        # Only flag it here, as this can run in the middle of anything; the next frame deals with it
+        self._resized = True
+        self.sched.wake()
+    
+    def _checkResize(self):
+        """Looks up the terminal size again if it's changed, redrawing everything and telling every app (once) if it's different"""
+        if not self._resized:
+            return
+        self._resized = False
+        old, self._size = self._size, self._querySize()
+        if self._size != old:
+            self._fullRedraw = True
+            self.screenUpdate()
+    
+    def blink(self, callback=None):
+        """Gets the cursor blink phase (0 = shown, 1 = hidden), calling `callback` (or just waking the main loop) when it next changes"""
+        now = time.time()
+        cycle = math.floor(now/1.5)*1.5
+        phase = math.floor(now-cycle)
+        self.sched.wakeAt(cycle + (1 if phase == 0 else 1.5), callback)
+        return phase
     
     def allLoadedApps(self, container=None):
         if container is None:
@@ -316,201 +895,288 @@ class TerminalAPI:
         elif self.focus[0] > len(self.layout[self.focus[1]][0]):
             self.focus[0] = len(self.layout[self.focus[1]][0])
     
+    def geometry(self):
+        """Gets where everything in the layout goes (see `lib.layout.Geometry`)"""
+        if self._geometry is None:
+            self._geometry = Geometry(self.layout, self.grid, self.get_terminal_size())
+        return self._geometry
+    
+    def layoutChanged(self):
+        """Call after changing `self.layout` or `self.grid` (screenUpdate does this too)"""
+        self._geometry = None
+    
+    def gridPos(self, app):
+        """Gets the (row, column) an app is at in the grid, or None if it isn't in it"""
+        pos = self.geometry().apps.get(app)
+        if pos is None: # It may have been put in the grid without telling us
+            self.layoutChanged()
+            pos = self.geometry().apps.get(app)
+        return pos
+    
     def screenUpdate(self):
+        self.layoutChanged()
         for elm in self.allLoadedApps():
             elm.onScreenUpdate()
         for elm in self.extras:
             elm.onScreenUpdate()
 
+    def _bindKeys(self):
+        self.globalKeys = KeyBindings() # These work in every mode
+        self.globalKeys.bind('super+ctrl+shift+L', self._showStats)
+        self.globalKeys.bind('super+ctrl+shift+P', lambda ev: self.profiler.toggle())
+
+        self.appKeys = KeyBindings()
+        self.appKeys.bind('super+A', lambda ev: self._setMode(ScreenModes.LAYOUT))
+        # Arrow keys switch between
+        self.appKeys.bind('super+UP', lambda ev: self._moveFocus(0, -1))
+        self.appKeys.bind('super+DOWN', lambda ev: self._moveFocus(0, 1))
+        self.appKeys.bind('super+LEFT', lambda ev: self._moveFocus(-1, 0))
+        self.appKeys.bind('super+RIGHT', lambda ev: self._moveFocus(1, 0))
+
+        self.layoutKeys = KeyBindings()
+        self.layoutKeys.bind('ESC', self._layoutExit)
+        # Creation - ctrl+<>
+        self.layoutKeys.bind('ctrl+W', self._splitUp)
+        self.layoutKeys.bind('ctrl+S', self._splitDown)
+        self.layoutKeys.bind('ctrl+A', self._splitLeft)
+        self.layoutKeys.bind('ctrl+D', self._splitRight)
+        # Deletion - ctrl+alt+<>
+        self.layoutKeys.bind('ctrl+alt+W', self._joinUp)
+        self.layoutKeys.bind('ctrl+alt+S', self._joinDown)
+        self.layoutKeys.bind('ctrl+alt+A', self._joinLeft)
+        self.layoutKeys.bind('ctrl+alt+D', self._joinRight)
+        # Arrow keys switch between
+        self.layoutKeys.bind('UP', lambda ev: self._moveFocus(0, -1))
+        self.layoutKeys.bind('DOWN', lambda ev: self._moveFocus(0, 1))
+        self.layoutKeys.bind('LEFT', lambda ev: self._moveFocus(-1, 0))
+        self.layoutKeys.bind('RIGHT', lambda ev: self._moveFocus(1, 0))
+        self.layoutKeys.bind('SPACE', self._layoutMove)
+        self.layoutKeys.bind('ENTER', self._layoutEnter)
+        self.layoutKeys.bind('BACKSPACE', self._layoutRemove)
+        self.layoutKeys.bind('DELETE', self._layoutRemove)
+        self.layoutKeys.bind('SLASH', self._layoutChoose)
+        # Just letters resize
+        self.layoutKeys.bind('W', self._resizeUp, states=(1, 2))
+        self.layoutKeys.bind('S', self._resizeDown, states=(1, 2))
+        self.layoutKeys.bind('A', self._resizeLeft, states=(1, 2))
+        self.layoutKeys.bind('D', self._resizeRight, states=(1, 2))
+
+        self.chooseKeys = KeyBindings()
+        self.chooseKeys.bind('ESC', lambda ev: self._setMode(ScreenModes.LAYOUT))
+        for chord in ('ctrl+ENTER', 'ctrl+shift+ENTER', 'ENTER', 'ctrl+LEFTSHIFT', 'ctrl+RIGHTSHIFT'):
+            self.chooseKeys.bind(chord, self._chooseApply)
+    
+    def _showStats(self, ev):
+        import lib.widgets as wids # The widgets need this module loaded first
+        if self.statsFile is not None:
+            stats.dump(self.statsFile)
+        Popup(wids.Text(StaticPos(0, 0), stats.report()), duration=10)
+    
+    def _setMode(self, mode):
+        self.mode = mode
+    
+    def _moveFocus(self, dx, dy):
+        self.focus[0] += dx
+        self.focus[1] += dy
+        self._fixFocus()
+    
+    def _layoutExit(self, ev):
+        self.screenUpdate()
+        self.mode = ScreenModes.APPS
+    
+    def _splitUp(self, ev):
+        sze = self.get_terminal_size()
+        hei = (self.layout[self.focus[1]][1] or sze[1]-sum([i[1] for i in self.layout if i[1]]+[0]))/2
+        if hei >= 2:
+            self.grid.insert(self.focus[1], [None])
+            self.layout.insert(self.focus[1], [[], math.floor(hei)])
+            if self.focus[1]+1 < len(self.layout)-1:
+                self.layout[self.focus[1]+1][1] = math.ceil(hei)
+        self._fixFocus()
+    
+    def _splitDown(self, ev):
+        sze = self.get_terminal_size()
+        hei = (self.layout[self.focus[1]][1] or sze[1]-sum([i[1] for i in self.layout if i[1]]+[0]))/2
+        if hei >= 2:
+            self.grid.insert(self.focus[1], [None])
+            self.layout.insert(self.focus[1], [[], math.ceil(hei)])
+            self.focus[1] += 1
+            if self.focus[1] < len(self.layout)-1:
+                self.layout[self.focus[1]][1] = math.floor(hei)
+            self._fixFocus()
+    
+    def _splitLeft(self, ev):
+        sze = self.get_terminal_size()
+        if self.focus[0] == len(self.layout[self.focus[1]][0]):
+            wid = (sze[0]-sum(self.layout[self.focus[1]][0]+[0]))/2
+        else:
+            wid = self.layout[self.focus[1]][0][self.focus[0]]/2
+            if wid >= 6:
+                self.layout[self.focus[1]][0][self.focus[0]] = math.floor(wid)
+        if wid >= 6:
+            self.grid[self.focus[1]].insert(self.focus[0], None)
+            self.layout[self.focus[1]][0].insert(self.focus[0], math.ceil(wid))
+            self._fixFocus()
+    
+    def _splitRight(self, ev):
+        sze = self.get_terminal_size()
+        if self.focus[0] == len(self.layout[self.focus[1]][0]):
+            wid = (sze[0]-sum(self.layout[self.focus[1]][0]+[0]))/2
+        else:
+            wid = self.layout[self.focus[1]][0][self.focus[0]]/2
+            if wid >= 2:
+                self.layout[self.focus[1]][0][self.focus[0]] = math.ceil(wid)
+        if wid >= 2:
+            self.grid[self.focus[1]].insert(self.focus[0], None)
+            self.layout[self.focus[1]][0].insert(self.focus[0], math.floor(wid))
+            self.focus[0] += 1
+            self._fixFocus()
+    
+    def _joinUp(self, ev):
+        if self.focus[1] != 0:
+            self.focus[1] -= 1
+            self.grid.pop(self.focus[1])
+            _, eh = self.layout.pop(self.focus[1])
+            if self.layout[self.focus[1]][1]:
+                self.layout[self.focus[1]][1] += eh
+            self._fixFocus()
+    
+    def _joinDown(self, ev):
+        if self.focus[1] < len(self.layout)-1:
+            self.grid.pop(self.focus[1])
+            _, eh = self.layout.pop(self.focus[1]+1)
+            self.layout[self.focus[1]][1] += eh
+            self._fixFocus()
+    
+    def _joinLeft(self, ev):
+        if self.focus[0] > 0:
+            self.focus[0] -= 1
+            self.grid[self.focus[1]].pop(self.focus[0])
+            ew = self.layout[self.focus[1]][0].pop(self.focus[0])
+            if self.focus[0] < len(self.layout[self.focus[1]][0]):
+                self.layout[self.focus[1]][0][self.focus[0]] += ew
+            self._fixFocus()
+    
+    def _joinRight(self, ev):
+        if self.focus[0] == len(self.layout[self.focus[1]][0])-1:
+            self.grid[self.focus[1]].pop(-1)
+            self.layout[self.focus[1]][0].pop(-1)
+        elif self.focus[0] < len(self.layout[self.focus[1]][0])-1:
+            self.grid[self.focus[1]].pop(self.focus[0]+1)
+            ew = self.layout[self.focus[1]][0].pop(self.focus[0]+1)
+            self.layout[self.focus[1]][0][self.focus[0]] += ew
+        self._fixFocus()
+    
+    def _layoutMove(self, ev):
+        if self.selected is not None:
+            self.grid[self.focus[1]][self.focus[0]] = self.selected
+            self.selected = None
+        else:
+            self.selected = self.grid[self.focus[1]][self.focus[0]]
+            self.grid[self.focus[1]][self.focus[0]] = None
+    
+    def _layoutEnter(self, ev):
+        if self.selected is not None:
+            self._layoutMove(ev)
+        else:
+            self.mode = ScreenModes.APPS
+    
+    def _layoutRemove(self, ev):
+        self.grid[self.focus[1]][self.focus[0]] = None
+    
+    def _layoutChoose(self, ev):
+        self.mode = ScreenModes.CHOOSE
+        self.searching = GapBuffer()
+        self._search()
+    
+    @staticmethod
+    def _halfPresses(ev):
+        """Like `ev.presses`, but only every other repeat counts (for resizing rows, which are about twice as tall as columns are wide)"""
+        return (ev.state == 1) + ev.heldFrames//2 - (ev.heldFrames-ev.repeats)//2
+    
+    def _resizeUp(self, ev):
+        for _ in range(self._halfPresses(ev)):
+            sze = self.get_terminal_size()
+            if self.focus[1] < len(self.layout)-1:
+                if self.layout[self.focus[1]][1] > 3:
+                    self.layout[self.focus[1]][1] -= 1
+                    self._fixFocus()
+            elif self.focus[1] > 0:
+                h = sze[1]-sum(i[1] for i in self.layout if i[1])
+                if h > 3:
+                    self.layout[self.focus[1]-1][1] += 1
+                self._fixFocus()
+    
+    def _resizeDown(self, ev):
+        for _ in range(self._halfPresses(ev)):
+            sze = self.get_terminal_size()
+            if self.focus[1] < len(self.layout)-1:
+                if sum(i[1] for i in self.layout if i[1])+1<(sze[1]-3):
+                    self.layout[self.focus[1]][1] += 1
+                    self._fixFocus()
+            elif self.focus[1] > 0 and self.layout[self.focus[1]-1][1] > 3:
+                self.layout[self.focus[1]-1][1] -= 1
+                self._fixFocus()
+    
+    def _resizeLeft(self, ev):
+        for _ in range(ev.presses):
+            sze = self.get_terminal_size()
+            if self.focus[0] < len(self.layout[self.focus[1]][0]) and self.layout[self.focus[1]][0][self.focus[0]] > 3:
+                self.layout[self.focus[1]][0][self.focus[0]] -= 1
+                self._fixFocus()
+            elif self.focus[0] > 0:
+                w = sze[0]-sum(self.layout[self.focus[1]][0])
+                if w > 3:
+                    self.layout[self.focus[1]][0][self.focus[0]-1] += 1
+                    self._fixFocus()
+    
+    def _resizeRight(self, ev):
+        for _ in range(ev.presses):
+            sze = self.get_terminal_size()
+            if self.focus[0] < len(self.layout[self.focus[1]][0]):
+                if sum(self.layout[self.focus[1]][0])+1<(sze[0]-3):
+                    self.layout[self.focus[1]][0][self.focus[0]] += 1
+                    self._fixFocus()
+            elif self.focus[0] > 0 and self.layout[self.focus[1]][0][self.focus[0]-1] > 3:
+                self.layout[self.focus[1]][0][self.focus[0]-1] -= 1
+                self._fixFocus()
+    
+    def _chooseApply(self, ev):
+        if self.chooseHold in self.searchTxts:
+            self.grid[self.focus[1]][self.focus[0]] = self.searchTxts[self.chooseHold]()
+        self.mode = ScreenModes.LAYOUT
+
     def updateAll(self):
+        self._checkResize()
+        for ev in self.events:
+            self.globalKeys.dispatch(ev)
         if self.mode == ScreenModes.APPS:
             for ev in self.events:
-                if ev.state == 1:
-                    if ev == 'super+A':
-                        self.mode = ScreenModes.LAYOUT
-                    # Arrow keys switch between
-                    elif ev == 'super+UP':
-                        self.focus[1] -= 1
-                        self._fixFocus()
-                    elif ev == 'super+DOWN':
-                        self.focus[1] += 1
-                        self._fixFocus()
-                    elif ev == 'super+LEFT':
-                        self.focus[0] -= 1
-                        self._fixFocus()
-                    elif ev == 'super+RIGHT':
-                        self.focus[0] += 1
-                        self._fixFocus()
+                self.appKeys.dispatch(ev)
             if self.fullscreen is not None:
-                self.fullscreen.update(True)
+                with self.profiler.section(f'{self.fullscreen.NAME} update'):
+                    self.fullscreen.update(True)
                 for elm in self.allLoadedApps():
                     if elm is not None and elm is not self.fullscreen and AppFlags.RunWhileFull in elm.FLAGS:
-                        elm.update(False)
+                        with self.profiler.section(f'{elm.NAME} update'):
+                            elm.update(False)
             else:
                 focusApp = self.grid[self.focus[1]][self.focus[0]]
                 if focusApp is not None:
-                    focusApp.update(True)
+                    with self.profiler.section(f'{focusApp.NAME} update'):
+                        focusApp.update(True)
                 for elm in self.allLoadedApps():
                     if elm is not None and elm is not focusApp and AppFlags.Background in elm.FLAGS:
-                        elm.update(False)
-            for elm in self.extras:
-                elm.update()
+                        with self.profiler.section(f'{elm.NAME} update'):
+                            elm.update(False)
         elif self.mode == ScreenModes.LAYOUT:
-            sze = self.get_terminal_size()
             for ev in self.events:
-                if ev.state == 1:
-                    if ev == 'ESC':
-                        self.screenUpdate()
-                        self.mode = ScreenModes.APPS
-                    
-                    # Creation - ctrl+<>
-                    if ev == 'ctrl+W':
-                        hei = (self.layout[self.focus[1]][1] or sze[1]-sum([i[1] for i in self.layout if i[1]]+[0]))/2
-                        if hei >= 2:
-                            self.grid.insert(self.focus[1], [None])
-                            self.layout.insert(self.focus[1], [[], math.floor(hei)])
-                            if self.focus[1]+1 < len(self.layout)-1:
-                                self.layout[self.focus[1]+1][1] = math.ceil(hei)
-                        self._fixFocus()
-                    elif ev == 'ctrl+S':
-                        hei = (self.layout[self.focus[1]][1] or sze[1]-sum([i[1] for i in self.layout if i[1]]+[0]))/2
-                        if hei >= 2:
-                            self.grid.insert(self.focus[1], [None])
-                            self.layout.insert(self.focus[1], [[], math.ceil(hei)])
-                            self.focus[1] += 1
-                            if self.focus[1] < len(self.layout)-1:
-                                self.layout[self.focus[1]][1] = math.floor(hei)
-                            self._fixFocus()
-                    elif ev == 'ctrl+A':
-                        if self.focus[0] == len(self.layout[self.focus[1]][0]):
-                            wid = (sze[0]-sum(self.layout[self.focus[1]][0]+[0]))/2
-                        else:
-                            wid = self.layout[self.focus[1]][0][self.focus[0]]/2
-                            if wid >= 6:
-                                self.layout[self.focus[1]][0][self.focus[0]] = math.floor(wid)
-                        if wid >= 6:
-                            self.grid[self.focus[1]].insert(self.focus[0], None)
-                            self.layout[self.focus[1]][0].insert(self.focus[0], math.ceil(wid))
-                            self._fixFocus()
-                    elif ev == 'ctrl+D':
-                        if self.focus[0] == len(self.layout[self.focus[1]][0]):
-                            wid = (sze[0]-sum(self.layout[self.focus[1]][0]+[0]))/2
-                        else:
-                            wid = self.layout[self.focus[1]][0][self.focus[0]]/2
-                            if wid >= 2:
-                                self.layout[self.focus[1]][0][self.focus[0]] = math.ceil(wid)
-                        if wid >= 2:
-                            self.grid[self.focus[1]].insert(self.focus[0], None)
-                            self.layout[self.focus[1]][0].insert(self.focus[0], math.floor(wid))
-                            self.focus[0] += 1
-                            self._fixFocus()
-                    
-                    # Deletion - ctrl+alt+<>
-                    elif ev == 'ctrl+alt+W':
-                        if self.focus[1] != 0:
-                            self.focus[1] -= 1
-                            self.grid.pop(self.focus[1])
-                            _, eh = self.layout.pop(self.focus[1])
-                            if self.layout[self.focus[1]][1]:
-                                self.layout[self.focus[1]][1] += eh
-                            self._fixFocus()
-                    elif ev == 'ctrl+alt+S':
-                        if self.focus[1] < len(self.layout)-1:
-                            self.grid.pop(self.focus[1])
-                            _, eh = self.layout.pop(self.focus[1]+1)
-                            self.layout[self.focus[1]][1] += eh
-                            self._fixFocus()
-                    elif ev == 'ctrl+alt+A':
-                        if self.focus[0] > 0:
-                            self.focus[0] -= 1
-                            self.grid[self.focus[1]].pop(self.focus[0])
-                            ew = self.layout[self.focus[1]][0].pop(self.focus[0])
-                            if self.focus[0] < len(self.layout[self.focus[1]][0]):
-                                self.layout[self.focus[1]][0][self.focus[0]] += ew
-                            self._fixFocus()
-                    elif ev == 'ctrl+alt+D':
-                        if self.focus[0] == len(self.layout[self.focus[1]][0])-1:
-                            self.grid[self.focus[1]].pop(-1)
-                            self.layout[self.focus[1]][0].pop(-1)
-                        elif self.focus[0] < len(self.layout[self.focus[1]][0])-1:
-                            self.grid[self.focus[1]].pop(self.focus[0]+1)
-                            ew = self.layout[self.focus[1]][0].pop(self.focus[0]+1)
-                            self.layout[self.focus[1]][0][self.focus[0]] += ew
-                        self._fixFocus()
-
-                    # Arrow keys switch between
-                    elif ev == 'UP':
-                        self.focus[1] -= 1
-                        self._fixFocus()
-                    elif ev == 'DOWN':
-                        self.focus[1] += 1
-                        self._fixFocus()
-                    elif ev == 'LEFT':
-                        self.focus[0] -= 1
-                        self._fixFocus()
-                    elif ev == 'RIGHT':
-                        self.focus[0] += 1
-                        self._fixFocus()
-                    
-                    elif ev == 'SPACE' or (ev == 'ENTER' and self.selected is not None):
-                        if self.selected is not None:
-                            self.grid[self.focus[1]][self.focus[0]] = self.selected
-                            self.selected = None
-                        else:
-                            self.selected = self.grid[self.focus[1]][self.focus[0]]
-                            self.grid[self.focus[1]][self.focus[0]] = None
-                    elif ev in ('BACKSPACE', 'DELETE'):
-                        self.grid[self.focus[1]][self.focus[0]] = None
-                    elif ev == 'ENTER':
-                        self.mode = ScreenModes.APPS
-                    elif ev == 'SLASH':
-                        self.mode = ScreenModes.CHOOSE
-                        self.searching = ''
-                        self._search()
-                
-                # Just letters resize
-                elif ev == 'W' and ev.heldFrames % 2 == 0:
-                    if self.focus[1] < len(self.layout)-1:
-                        if self.layout[self.focus[1]][1] > 3:
-                            self.layout[self.focus[1]][1] -= 1
-                            self._fixFocus()
-                    elif self.focus[1] > 0:
-                        h = sze[1]-sum(i[1] for i in self.layout if i[1])
-                        if h > 3:
-                            self.layout[self.focus[1]-1][1] += 1
-                        self._fixFocus()
-                elif ev == 'S' and ev.heldFrames % 2 == 0:
-                    if self.focus[1] < len(self.layout)-1:
-                        if sum(i[1] for i in self.layout if i[1])+1<(sze[1]-3):
-                            self.layout[self.focus[1]][1] += 1
-                            self._fixFocus()
-                    elif self.focus[1] > 0 and self.layout[self.focus[1]-1][1] > 3:
-                        self.layout[self.focus[1]-1][1] -= 1
-                        self._fixFocus()
-                elif ev == 'A':
-                    if self.focus[0] < len(self.layout[self.focus[1]][0]) and self.layout[self.focus[1]][0][self.focus[0]] > 3:
-                        self.layout[self.focus[1]][0][self.focus[0]] -= 1
-                        self._fixFocus()
-                    elif self.focus[0] > 0:
-                        w = sze[0]-sum(self.layout[self.focus[1]][0])
-                        if w > 3:
-                            self.layout[self.focus[1]][0][self.focus[0]-1] += 1
-                            self._fixFocus()
-                elif ev == 'D':
-                    if self.focus[0] < len(self.layout[self.focus[1]][0]):
-                        if sum(self.layout[self.focus[1]][0])+1<(sze[0]-3):
-                            self.layout[self.focus[1]][0][self.focus[0]] += 1
-                            self._fixFocus()
-                    elif self.focus[0] > 0 and self.layout[self.focus[1]][0][self.focus[0]-1] > 3:
-                        self.layout[self.focus[1]][0][self.focus[0]-1] -= 1
-                        self._fixFocus()
+                if self.layoutKeys.dispatch(ev):
+                    self.layoutChanged()
         elif self.mode == ScreenModes.CHOOSE:
             sze = self.get_terminal_size()
             MAX_LEN = round(sze[0]/5)
             MAX_LINES = round(sze[1]/5)
-            FILLER = '⓿'
-            if FILLER not in self.searching:
-                self.searching += FILLER
             self.chooseHold = None
             MAP = {
                 'u': 'ctrl+UP', 'd': 'ctrl+DOWN', 'l': 'ctrl+LEFT', 'r': 'ctrl+RIGHT'
@@ -524,52 +1190,29 @@ class TerminalAPI:
                     break
             change = False
             for ev in self.events:
-                change_now = False
-                if ev.state == 1:
-                    if ev == 'ESC':
-                        self.mode = ScreenModes.LAYOUT
-                    elif ev in ('ctrl+ENTER', 'ctrl+shift+ENTER', 'ENTER', 'ctrl+LEFTSHIFT', 'ctrl+RIGHTSHIFT'):
-                        if self.chooseHold in self.searchTxts:
-                            self.grid[self.focus[1]][self.focus[0]] = self.searchTxts[self.chooseHold]()
-                        self.mode = ScreenModes.LAYOUT
-                    elif ev == 'UP':
-                        self.searching = self.searching[:max(self.searching.index(FILLER)-MAX_LEN, 0)].replace(FILLER, '')+\
-                                         FILLER+\
-                                         self.searching[max(self.searching.index(FILLER)-MAX_LEN, 0):].replace(FILLER, '')
+                search = self.searching
+                if self.chooseKeys.dispatch(ev):
+                    self.layoutChanged()
+                elif ev.state == 1:
+                    if ev == 'UP':
+                        search.moveTo(search.cursor-MAX_LEN)
                     elif ev == 'DOWN':
-                        self.searching = self.searching[:self.searching.index(FILLER)+MAX_LEN+1].replace(FILLER, '')+\
-                                         FILLER+\
-                                         self.searching[self.searching.index(FILLER)+MAX_LEN+1:].replace(FILLER, '')
+                        search.moveTo(search.cursor+MAX_LEN)
                     elif ev == 'LEFT':
-                        self.searching = self.searching[:max(self.searching.index(FILLER)-1, 0)].replace(FILLER, '')+\
-                                         FILLER+\
-                                         self.searching[max(self.searching.index(FILLER)-1, 0):].replace(FILLER, '')
+                        search.moveTo(search.cursor-1)
                     elif ev == 'RIGHT':
-                        self.searching = self.searching[:self.searching.index(FILLER)+2].replace(FILLER, '')+\
-                                         FILLER+\
-                                         self.searching[self.searching.index(FILLER)+2:].replace(FILLER, '')
-                if ev.state == 1 or (ev.heldFor > 0.8 and ev.heldFrames % 4 == 0):
+                        search.moveTo(search.cursor+1)
+                for _ in range(ev.presses): # Once per press or repeat
                     if ev == 'BACKSPACE':
-                        self.searching = self.searching[:self.searching.index(FILLER)-1].replace(FILLER, '')+\
-                                         FILLER+\
-                                         self.searching[self.searching.index(FILLER)+1:].replace(FILLER, '')
-                        change_now = True
+                        search.backspace()
+                        change = True
                     elif ev == 'DELETE':
-                        self.searching = self.searching[:self.searching.index(FILLER)].replace(FILLER, '')+\
-                                         FILLER+\
-                                         self.searching[self.searching.index(FILLER)+2:].replace(FILLER, '')
-                        change_now = True
+                        search.delete()
+                        change = True
                     elif ev.unicode is not None:
-                        self.searching = self.searching[:self.searching.index(FILLER)].replace(FILLER, '')+\
-                                         ev.unicode+\
-                                         FILLER+\
-                                         self.searching[self.searching.index(FILLER)+1:].replace(FILLER, '')
-                        change_now = True
-                if change_now:
-                    change = True
-                    if FILLER not in self.searching:
-                        self.searching = self.searching + FILLER
-                    self.searching = self.searching[:MAX_LEN*MAX_LINES+1]
+                        search.insert(ev.unicode)
+                        search.truncate(MAX_LEN*MAX_LINES)
+                        change = True
 
             if change:
                 self._search()
@@ -584,22 +1227,51 @@ class TerminalAPI:
             self.searchTxts[idx] = res
 
     def resetScreens(self):
+        sze = self.get_terminal_size()
+        if (self.Screen.width, self.Screen.height) != sze:
+            self.Screen, self._oldScreen = Screen(*sze), Screen(*sze)
+            self._fullRedraw = True
+            return
         self._oldScreen, self.Screen = self.Screen, self._oldScreen
         self.Screen.Clear()
     
+    def _placePopups(self):
+        """Stacks the popups up from the bottom right corner (drawing any that changed), and works out what they cover so the apps don't draw there"""
+        cols, rows = self.get_terminal_size()
+        self.popups = []
+        self.occluded = None
+        y = rows
+        for popup in self.extras:
+            with self.profiler.section('Popup draw'):
+                surface = popup.draw()
+            if surface is None:
+                continue
+            x, y = cols-surface.width, y-surface.height
+            self.popups.append((surface, x, y))
+            if self.occluded is None:
+                self.occluded = array('I', [cols])*rows
+            for sy in surface.Used():
+                if 0 <= y+sy < rows:
+                    self.occluded[y+sy] = min(self.occluded[y+sy], max(x, 0))
+    
     def drawAll(self):
+        self.popups, self.occluded = [], None
         if self.mode == ScreenModes.APPS:
+            self._placePopups()
             if self.fullscreen is not None:
                 self.bottomTxt = ''
-                self.fullscreen.draw()
+                with self.profiler.section(f'{self.fullscreen.NAME} draw'):
+                    self.fullscreen.draw()
             else:
                 focusApp = self.grid[self.focus[1]][self.focus[0]]
                 for elm in self.allLoadedApps():
                     if elm is not None and elm is not focusApp:
-                        elm.draw()
+                        with self.profiler.section(f'{elm.NAME} draw'):
+                            elm.draw()
                 self.bottomTxt = ''
                 if focusApp is not None: # Draw this last so it can set self.bottomTxt
-                    focusApp.draw()
+                    with self.profiler.section(f'{focusApp.NAME} draw'):
+                        focusApp.draw()
         elif self.mode == ScreenModes.CHOOSE:
             self.bottomTxt = 'ctrl+←↑→↓: choose | shift/enter: apply | esc: exit'
             sze = self.get_terminal_size()
@@ -642,13 +1314,15 @@ class TerminalAPI:
                     self.Screen.Write(sx+(ml-len(ln))//2, sy+idx2, ptxt)
             
             lines = ['_'*MAX_LEN for _ in range(MAX_LINES)]
-            for ln in range(min(math.ceil(len(self.searching)/MAX_LEN), MAX_LINES)):
-                lnt = self.searching[ln*MAX_LEN:(ln+1)*MAX_LEN]
+            cur = self.searching.cursor
+            search = self.searching.text(0, cur)+'⓿'+self.searching.text(cur)
+            for ln in range(min(math.ceil(len(search)/MAX_LEN), MAX_LINES)):
+                lnt = search[ln*MAX_LEN:(ln+1)*MAX_LEN]
                 tlen = (MAX_LEN-len(lnt))//2
                 lines[ln] = ('_'*tlen+lnt+'_'*tlen+'_')[:MAX_LEN]
             midy = (sze[1]-len(lines)+1)//2
             for idx, ln in enumerate(lines):
-                self.Screen.Write((sze[0]-len(ln))//2, midy+idx, '\033[0m', ln.replace('⓿', ['\033[7m_\033[27m', ' '][math.floor(time.time()%1.5)]))
+                self.Screen.Write((sze[0]-len(ln))//2, midy+idx, '\033[0m', ln.replace('⓿', ['\033[7m_\033[27m', ' '][self.blink()]))
         elif self.mode == ScreenModes.LAYOUT:
             self.bottomTxt = '←↑→↓: choose | WASD: resize | ctrl+WASD: create | ctrl+alt+WASD: remove | /: select app | space: move app | esc: exit'
     
@@ -661,17 +1335,18 @@ class TerminalAPI:
         self.Screen.Write(0, sze[1]-1, '└', '─' * (sze[0]-2), '┘')
         if self.mode == ScreenModes.CHOOSE:
             return
-        sy = 0
-        for yidx, (row, h) in enumerate(self.layout):
-            if h is None:
-                h = sze[1]-sy-1
+        geo = self.geometry()
+        last = len(geo.rows)-1
+        for yidx, (sy, h) in enumerate(geo.rows):
+            if yidx == last:
+                h -= 1 # It ends at the bottom border
             else:
                 for ix in range(1, sze[0]-1):
                     self.Screen.Write(ix, sy+h, '─')
                 self.Screen.Write(0, sy+h, '├')
                 self.Screen.Write(sze[0]-1, sy+h, '┤')
-            sx = 0
-            for xidx, w in enumerate(row+[None]):
+            cols = geo.cols[yidx]
+            for xidx, (sx, w) in enumerate(cols):
                 if self.mode == ScreenModes.LAYOUT:
                     txt = self.grid[yidx][xidx]
                     thisSel = False
@@ -679,98 +1354,89 @@ class TerminalAPI:
                         thisSel = True
                         txt = self.selected
                     if txt is not None:
-                        if w is None:
-                            w = sze[0]-sx
                         lines = str(txt).split('\n')
                         midy = sy+max(h-len(lines)+1-int(thisSel)*2, 0)//2
                         for idx, ln in enumerate(lines[:h]):
                             self.Screen.Write(sx+max(w-len(ln)-int(thisSel)*2, 0)//2, midy+idx, ln[:w])
-                if w is not None:
-                    sx += w
-                    chr = self.Screen.Get(sx, sy)
+                if xidx < len(cols)-1:
+                    ex = sx+w
+                    chr = self.Screen.Get(ex, sy)
                     if chr == '┴':
-                        self.Screen.Write(sx, sy, '┼')
+                        self.Screen.Write(ex, sy, '┼')
                     elif chr != '+':
-                        self.Screen.Write(sx, sy, '┬')
-                    self.Screen.Write(sx, sy+h, '┴')
+                        self.Screen.Write(ex, sy, '┬')
+                    self.Screen.Write(ex, sy+h, '┴')
                     for iy in range(1+sy, sy+h):
-                        self.Screen.Write(sx, iy, '│')
-            sy += h
+                        self.Screen.Write(ex, iy, '│')
         self.Screen.Write(sze[0]-1-len(self.bottomTxt), sze[1]-1, self.bottomTxt)
         
+        if self.mode not in (ScreenModes.LAYOUT, ScreenModes.APPS):
+            return
+        mny, h = geo.rows[self.focus[1]]
+        mxy = mny+h-(self.focus[1] == last)
+        x1, w = geo.cols[self.focus[1]][self.focus[0]]
+        x2 = min(x1+w, sze[0]-1)
         if self.mode == ScreenModes.LAYOUT:
-            hs = [i[1] for i in self.layout[:-1]]
-            hs += [sze[1]-sum(hs+[0])-1]
-            ws = self.layout[self.focus[1]][0].copy()
-            ws += [sze[0]-sum(ws+[0])]
-            y = 0
-            mxy = sum(hs[:self.focus[1]+1]+[0])
             extra = '27;103;30' if (self.selected is not None) else '7'
-            for y in range(sum(hs[:self.focus[1]]+[0]), mxy+1):
-                x1 = sum(ws[:self.focus[0]]+[0])
-                x2 = min(sum(ws[:self.focus[0]+1]+[0]), sze[0]-1)
+            for y in range(mny, mxy+1):
                 if y == mxy:
-                    self.Screen.Write(x1, y, f'\033[{extra}m', self.Screen.Get(x1, y))
-                    self.Screen.Write(x2, y, self.Screen.Get(x2, y), '\033[0m')
+                    self.Screen.Restyle(x1, y, x2-x1+1, f'\033[{extra}m')
                 else:
-                    self.Screen.Write(x1, y, '\033[7m', self.Screen.Get(x1, y))
-                    self.Screen.Write(x2, y, f'\033[{extra}m{self.Screen.Get(x2, y)}\033[0m')
-        
-        if self.mode == ScreenModes.APPS:
-            hs = [i[1] for i in self.layout[:-1]]
-            hs += [sze[1]-sum(hs+[0])-1]
-            ws = self.layout[self.focus[1]][0].copy()
-            ws += [sze[0]-sum(ws+[0])]
-            y = 0
-            mny = sum(hs[:self.focus[1]]+[0])
-            mxy = sum(hs[:self.focus[1]+1]+[0])
+                    self.Screen.Restyle(x1, y, x2-x1, '\033[7m')
+                    self.Screen.Restyle(x2, y, 1, f'\033[{extra}m')
+        else:
             for y in range(mny, mxy+1):
-                x1 = sum(ws[:self.focus[0]]+[0])
-                x2 = min(sum(ws[:self.focus[0]+1]+[0]), sze[0]-1)
                 if y == mny or y == mxy:
-                    self.Screen.Write(x1, y, '\033[46;30m', self.Screen.Get(x1, y))
-                    self.Screen.Write(x2, y, self.Screen.Get(x2, y), '\033[0m')
+                    self.Screen.Restyle(x1, y, x2-x1+1, '\033[46;30m')
                 else:
-                    self.Screen.Write(x1, y, f'\033[46;30m{self.Screen.Get(x1, y)}\033[0m')
-                    self.Screen.Write(x2, y, f'\033[46;30m{self.Screen.Get(x2, y)}\033[0m')
+                    self.Screen.Restyle(x1, y, 1, '\033[46;30m')
+                    self.Screen.Restyle(x2, y, 1, '\033[46;30m')
+    
+    def _drawTop(self):
+        """Draws the borders and everything that goes over the apps"""
+        with self.profiler.section('borders'):
+            self._print_borders()
+        for surface, x, y in self.popups:
+            self.Screen.Blit(surface, x, y)
+        if self.profiler.enabled:
+            for idx, ln in enumerate(self.profiler.lines()):
+                self.Screen.Write(1, idx+1, f'\033[100;97m{ln}\033[0m')
+    
+    def _render(self, clear):
+        start = time.perf_counter()
+        self.renderer.render(self.Screen, self._oldScreen, clear)
+        self.profiler.add('diff', time.perf_counter()-start-self.renderer.flushTime)
+        self.profiler.add('flush', self.renderer.flushTime)
+        self._recordLatency()
     
     def print(self):
-        self._print_borders()
-        if self.mode == ScreenModes.APPS:
-            for elm in self.extras:
-                elm.draw()
-        winSize = self.get_terminal_size()
-        for y, oldrow in self._oldScreen.screen.items():
-            if y < 0 or y > winSize[1]-1:
-                continue
-            if y in self.Screen.screen:
-                newrow = self.Screen.screen[y]
-                if oldrow != newrow:
-                    sys.stdout.write(f'\033[{y+1};1H'+str(newrow[:winSize[0]+1])[:-1]+'\033[K')
-            else:
-                sys.stdout.write(f'\033[{y+1};1H\033[K')
-        for y, newrow in self.Screen.screen.items():
-            if y < 0 or y > winSize[1]-1:
-                continue
-            if y not in self._oldScreen.screen:
-                sys.stdout.write(f'\033[{y+1};1H'+str(newrow[:winSize[0]+1])[:-1])
+        if self._fullRedraw:
+            self.printAll()
+            return
+        self._drawTop()
+        self._render(False)
     
     def printAll(self):
-        self._print_borders()
-        if self.mode == ScreenModes.APPS:
-            for elm in self.extras:
-                elm.draw()
-        winSize = self.get_terminal_size()
-        for y in range(winSize[1]):
-            if y in self.Screen.screen:
-                new = str(self.Screen.screen[y])
-            else:
-                new = ''
-            
-            sys.stdout.write(f'\033[{y+1};1H\033[K'+str(new[:winSize[0]+1])[:-1])
+        self._fullRedraw = False
+        self._drawTop()
+        self._oldScreen.Clear()
+        self._render(True)
+    
+    def _recordLatency(self):
+        """Records how long each new event took to get to the screen, now the frame after it has been written"""
+        now = time.time()
+        for ev in self.events:
+            if not ev.shown:
+                ev.shown = True
+                self.latency.add(now-ev.timestamp)
+    
+    def get_terminal_size(self):
+        if self._size is None:
+            self._size = self._querySize()
+        return self._size
     
     @staticmethod
-    def get_terminal_size():
+    def _querySize():
         sze = shutil.get_terminal_size()
         return sze.columns, sze.lines
 
@@ -812,6 +1478,23 @@ class WidgetMeta(type):
         new_class.__new__ = newNew
         return new_class
 
+_UNSET = object()
+
+class Redraws:
+    """A widget attribute that makes the widget get drawn again whenever it's changed"""
+    def __set_name__(self, owner, name):
+        self.name = '_'+name
+    
+    def __get__(self, inst, owner):
+        if inst is None:
+            return self
+        return getattr(inst, self.name)
+    
+    def __set__(self, inst, value):
+        if getattr(inst, self.name, _UNSET) != value:
+            setattr(inst, self.name, value)
+            inst.invalidate()
+
 class Widget(metaclass=WidgetMeta):
     parent: 'Container'
     
@@ -829,6 +1512,10 @@ class Widget(metaclass=WidgetMeta):
     def update(self, focus):
         pass
     
+    def invalidate(self):
+        """Marks this widget as needing to be drawn again"""
+        self.parent.invalidate()
+    
     @property
     def _Screen(self) -> Screen:
         return self.parent.Screen
@@ -871,10 +1558,17 @@ class WidgetContainer(list):
 class Container:
     API = TerminalAPI()
     Screen: Screen
+    dirty = True # Whether the widgets need to be drawn again
+
+    def invalidate(self):
+        self.dirty = True
 
     def Size(self):
         return 0, 0
 
+    def onScreenUpdate(self):
+        pass
+
 class Popup(Container):
     def __new__(cls, *args, **kwargs):
         inst = super().__new__(cls)
@@ -888,31 +1582,51 @@ class Popup(Container):
     def __init__(self, *widgets, duration=3, max_width=None):
         self.max_width = max_width
         self.widgets = WidgetContainer(self, widgets)
-        self.Screen = Screen()
+        self.Screen = Screen(*self.API.get_terminal_size())
         self.duration = duration
         self.start_time = time.time()
+        self.timer = self.API.sched.callAt(self.start_time+duration, self.close) # Nothing needs checking until then
         self.width, self.height = 0, 0
+        self.surface = None
+    
+    def close(self):
+        """Takes the popup off the screen"""
+        self.API.sched.cancel(self.timer)
+        if self in self.API.extras:
+            self.API.extras.remove(self)
+        self.API.sched.invalidate()
     
     def Size(self):
         return self.width, self.height
     
     def draw(self):
-        self.Screen.Clear()
+        """Gets the popup (border and all) as a screen, or None if it's empty. Its widgets only get drawn again when they change."""
+        cols, rows = self.API.get_terminal_size()
+        if (self.Screen.width, self.Screen.height) != (cols, rows):
+            self.Screen = Screen(cols, rows)
+        elif not self.dirty:
+            return self.surface
+        else:
+            self.Screen.Clear()
         for widget in self.widgets:
             widget.draw(False)
+        self.dirty = False
 
-        cols, rows = self.API.get_terminal_size()
-        self.width = max(len(i) for i in self.Screen.screen.values()) + 2
-        self.height = max(self.Screen.screen.keys()) + 3
-        x, y = cols - self.width, rows - self.height
-        self.API.Screen.Write(x, y, '\033[100;34;1m│\033[39m', ' '*self.width, ' \033[0m')
-        for idx, ln in self.Screen.screen.items():
-            self.API.Screen.Write(x, y+idx+1, f'\033[100;34;1m│\033[39{";22" if idx > 0 else ""}m{str(ln)} {" "*(self.width-len(ln))}\033[0m')
-        self.API.Screen.Write(x, y+self.height-1, '\033[100;34;1m│\033[39m', ' '*self.width, ' \033[0m')
-    
-    def update(self):
-        if time.time() - self.start_time > self.duration:
-            self.__del__()
+        used = self.Screen.Used()
+        if not used:
+            self.surface = None
+            return None
+        size = (max(self.Screen.Length(i) for i in used) + 2, max(used) + 3)
+        if size != (self.width, self.height): # Widgets can be placed by the popup's size, so draw them again at the new one next frame
+            self.width, self.height = size
+            self.dirty = True
+            self.API.sched.invalidate()
+        self.surface = Screen(self.width, self.height)
+        self.surface.Write(0, 0, '\033[100;34;1m│\033[39m', ' '*self.width, ' \033[0m')
+        for idx in used:
+            self.surface.Write(0, idx+1, f'\033[100;34;1m│\033[39{";22" if idx > 0 else ""}m', self.Screen.Cells(idx), f' {" "*(self.width-self.Screen.Length(idx))}\033[0m')
+        self.surface.Write(0, self.height-1, '\033[100;34;1m│\033[39m', ' '*self.width, ' \033[0m')
+        return self.surface
 
 class AppMeta(type):
     def __new__(cls, name, bases, class_dict):
@@ -947,73 +1661,67 @@ class App(Container, metaclass=AppMeta):
     NAME = 'DEFAULT APP'
     FLAGS: list[AppFlags]
     def __init__(self, widgets=None):
-        self.Screen = None
+        self.Screen = None # Kept between frames, and only drawn again when something on it changes
+        self._drawn = None # What the screen was drawn with
         self.focus = False
         self.focusElm = 0
         self.widgets = WidgetContainer(self, widgets or [])
+        self.keys = KeyBindings() # Apps can bind their own keys in here, which work while the app is in focus
+        self.keys.bind('ctrl+RIGHT', self._focusNext)
+        self.keys.bind('TAB', self._focusNext)
+        self.keys.bind('ctrl+LEFT', self._focusPrev)
+        self.keys.bind('shift+TAB', self._focusPrev)
     
     def _gridPos(self):
-        for yidx, row in enumerate(self.API.grid):
-            if self in row:
-                return yidx, row.index(self)
+        return self.API.gridPos(self)
     
     def Size(self, gridP=None):
         if gridP is None:
-            y, x = self._gridPos()
-        else:
-            y, x = gridP
-        thisrow = self.API.layout[y]
-        tsze = self.API.get_terminal_size()
-        if thisrow[1] is None:
-            hei = tsze[1]-sum(i[1] for i in self.API.layout if i[1] is not None)
-        else:
-            hei = thisrow[1]
-        
-        if x >= len(thisrow[0]):
-            wid = tsze[0]-sum(thisrow[0])
-        else:
-            wid = thisrow[0][x]
-        
-        return wid, hei
+            gridP = self._gridPos()
+        return self.API.geometry().rect(*gridP)[2:]
     
     def Pos(self, gridP=None):
         if gridP is None:
-            y, x = self._gridPos()
-        else:
-            y, x = gridP
-        return sum(self.API.layout[y][0][:x] or [0]), sum([i[1] for i in self.API.layout[:y]] or [0])
+            gridP = self._gridPos()
+        return self.API.geometry().rect(*gridP)[:2]
 
     def onScreenUpdate(self):
         pass
     
     def draw(self):
-        self.Screen = Screen()
-        for idx, w in enumerate(self.widgets):
-            w.draw(self.focusElm == idx)
-        
-        gridP = self._gridPos()
-        x, y = self.Pos(gridP)
-        wid, hei = self.Size(gridP)
-        for idx, ln in self.Screen.screen.items():
-            if idx <= hei-2:
-                self.API.Screen.Write(x+1, y+idx+1, str(ln[:wid-2]))
+        x, y, wid, hei = self.API.geometry().rect(*self._gridPos())
+        drawn = (wid, hei, self.focusElm, list(self.widgets))
+        if self.dirty or drawn != self._drawn:
+            if self.Screen is None or (self.Screen.width, self.Screen.height) != (wid-2, hei-1):
+                self.Screen = Screen(wid-2, hei-1)
+            else:
+                self.Screen.Clear()
+            for idx, w in enumerate(self.widgets):
+                w.draw(self.focusElm == idx)
+            self.dirty = False # After drawing, so widgets changing themselves while drawing don't make it draw every frame
+            self._drawn = drawn
+        self.API.Screen.Blit(self.Screen, x+1, y+1, self.API.occluded)
+
+    def _focusNext(self, ev):
+        self.focusElm = min(self.focusElm+1, len(self.widgets)-1)
+    
+    def _focusPrev(self, ev):
+        self.focusElm = max(self.focusElm-1, 0)
 
     def update(self, focus):
         self.focus = focus
         changed = False
         if self.focus:
+            oldFocus = self.focusElm
             for ev in self.API.events:
-                if ev.state == 1:
-                    if ev == 'ctrl+RIGHT' or ev == 'TAB':
-                        self.focusElm = min(self.focusElm+1, len(self.widgets)-1)
-                        changed = True
-                    elif ev == 'ctrl+LEFT' or ev == 'shift+TAB':
-                        self.focusElm = max(self.focusElm-1, 0)
-                        changed = True
-        if changed:
+                self.keys.dispatch(ev)
+            changed = self.focusElm != oldFocus
+        if changed: # Don't let a key held down from before start repeating straight into the new widget
             for ev in self.API.events:
                 ev.heldFrames = 0
+                ev.repeats = 0
                 ev.startHoldTime = time.time()
+            self.API.keyRepeat.restart()
         for idx, w in enumerate(self.widgets):
             w.update(self.focusElm == idx)
     
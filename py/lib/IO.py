@@ -1,8 +1,11 @@
-from evdev import InputDevice, list_devices, categorize, ecodes
+from evdev import InputDevice, list_devices, ecodes
+from enum import IntFlag
 import time
-from multiprocessing import Process, Pipe
+import struct
+import os
+from multiprocessing import Process
 
-__all__ = ['Key', 'KbdInp']
+__all__ = ['Mods', 'KeyChord', 'KeyBindings', 'Key', 'KeyRepeat', 'KbdInp']
 
 def find_keyboard():
     for dev_path in list_devices():
@@ -37,24 +40,99 @@ KEY_MAPPING = {
     '0':          ('0', ')'),
 }
 
+class Mods(IntFlag):
+    SHIFT = 1
+    CTRL = 2
+    ALT = 4
+    SUPER = 8
+
+class KeyChord:
+    """A key name with the modifiers held with it (e.g. `super+UP`). These are interned, so there is only ever one of each and they can be compared with `is`."""
+    __slots__ = ('mods', 'key')
+    _CHORDS = {}
+    _PARSED = {}
+
+    def __new__(cls, mods, key):
+        ident = (int(mods), key)
+        if ident not in cls._CHORDS:
+            inst = super().__new__(cls)
+            inst.mods, inst.key = Mods(mods), key
+            cls._CHORDS[ident] = inst
+        return cls._CHORDS[ident]
+
+    @classmethod
+    def parse(cls, txt):
+        """Gets the chord for a string like `'ctrl+alt+W'` (case and modifier order don't matter). Each string only gets parsed once."""
+        if txt not in cls._PARSED:
+            mods = Mods(0)
+            keys = []
+            for part in txt.upper().split('+'):
+                if part in Mods.__members__:
+                    mods |= Mods[part]
+                else:
+                    keys.append(part)
+            cls._PARSED[txt] = cls(mods, '+'.join(keys))
+        return cls._PARSED[txt]
+
+    def __str__(self):
+        out = self.key
+        for mod in (Mods.SUPER, Mods.CTRL, Mods.ALT, Mods.SHIFT):
+            if self.mods & mod:
+                out = mod.name.lower()+'+'+out
+        return out
+    def __repr__(self):
+        return f'<KeyChord {str(self)}>'
+
+class KeyBindings:
+    """A table of handlers for key chords, so finding what an event does is one dict lookup however many bindings there are"""
+    def __init__(self):
+        self.table = {}
+
+    def bind(self, chord, handler, states=(1,)):
+        """Calls `handler(event)` for events of `chord` (a KeyChord or a string like `'ctrl+W'`) that are in one of the `states` (0 = up, 1 = down, 2 = hold)"""
+        if not isinstance(chord, KeyChord):
+            chord = KeyChord.parse(chord)
+        for state in states:
+            self.table[(chord, state)] = handler
+
+    def dispatch(self, ev):
+        """Calls the handler bound to the event, returning whether there was one"""
+        handler = self.table.get((ev.chord, ev.state))
+        if handler is None:
+            return False
+        handler(ev)
+        return True
+
+def _keyName(code):
+    try:
+        key_name = ecodes.KEY[code]
+    except KeyError:
+        return f"[{code}]"
+    if isinstance(key_name, list): # Some codes have more than one name
+        key_name = key_name[0]
+    if key_name.startswith("KEY_"):
+        return key_name[4:]
+    return key_name
+
 class Key:
-    def __init__(self, code, state, modifs):
+    def __init__(self, code, state, mods, timestamp=None):
         self.scancode = code
         self.state = state
-        try:
-            key_name = ecodes.KEY[code]
-            if key_name.startswith("KEY_"):
-                self.keyName = key_name[4:]
-            else:
-                self.keyName = key_name
-        except KeyError:
-            self.keyName = f"[{code}]"
-        self.startHoldTime = time.time()
-        self.heldFrames = 0
-        self.shift = modifs['shift']
-        self.ctrl = modifs['ctrl']
-        self.alt = modifs['alt']
-        self.super = modifs['super']
+        self.keyName = _keyName(code)
+        self.timestamp = time.time() if timestamp is None else timestamp # When the kernel saw the event
+        self.startHoldTime = self.timestamp
+        self.heldFrames = 0 # How many times it's repeated so far
+        self.repeats = 0 # How many times it repeated since the last frame
+        self.shown = False # Whether a frame showing this event has been drawn yet (for measuring latency)
+        self.setMods(mods)
+    
+    def setMods(self, mods):
+        """Changes the modifiers held with the key (e.g. shift being pressed while it's held), updating its chord and unicode to match"""
+        self.shift = bool(mods & Mods.SHIFT)
+        self.ctrl = bool(mods & Mods.CTRL)
+        self.alt = bool(mods & Mods.ALT)
+        self.super = bool(mods & Mods.SUPER)
+        self.chord = KeyChord(mods, self.keyName)
 
         if len(self.keyName) == 1 and self.keyName.isalpha():
             self.unicode = self.keyName.upper() if self.shift else self.keyName.lower()
@@ -68,17 +146,13 @@ class Key:
     def heldFor(self):
         return time.time() - self.startHoldTime
     
+    @property
+    def presses(self):
+        """How many times this frame the key counts as being pressed, including repeats from holding it down"""
+        return (self.state == 1) + self.repeats
+    
     def __str__(self):
-        infset = self.keyName
-        if self.super:
-            infset = 'super+'+infset
-        if self.ctrl:
-            infset = 'ctrl+'+infset
-        if self.alt:
-            infset = 'alt+'+infset
-        if self.shift:
-            infset = 'shift+'+infset
-        return infset
+        return str(self.chord)
     def __repr__(self):
         return f'<Key event: {str(self)}: {["up", "down", "hold"][self.state]} held for {self.heldFor}>'
 
@@ -100,64 +174,187 @@ class Key:
     
     def __eq__(self, other):
         if isinstance(other, Key):
-            return all(getattr(self, i) == getattr(other, i) for i in ('scancode', 'state', 'shift', 'ctrl', 'alt', 'super'))
-        return set(i.upper() for i in str(other).split('+')) == self._infSet
+            return self.scancode == other.scancode and self.state == other.state and self.chord is other.chord
+        if isinstance(other, KeyChord):
+            return self.chord is other
+        if isinstance(other, str):
+            return self.chord is KeyChord.parse(other)
+        return NotImplemented
+
+_MOD_KEYS = {
+    ecodes.KEY_LEFTMETA: Mods.SUPER, ecodes.KEY_RIGHTMETA: Mods.SUPER,
+    ecodes.KEY_LEFTALT: Mods.ALT, ecodes.KEY_RIGHTALT: Mods.ALT,
+    ecodes.KEY_LEFTCTRL: Mods.CTRL, ecodes.KEY_RIGHTCTRL: Mods.CTRL,
+    ecodes.KEY_LEFTSHIFT: Mods.SHIFT, ecodes.KEY_RIGHTSHIFT: Mods.SHIFT,
+}
+def _trackMods(mods, code, state):
+    """Gets the modifiers to send with a key event (a modifier key doesn't count as holding itself), and the modifiers held after it"""
+    mod = _MOD_KEYS.get(code)
+    if mod is None:
+        return mods, mods
+    send = mods & ~mod
+    return send, (send | mod) if state != 0 else send # 1 = Pressed, 0 = Released, 2 = Hold
+
+class KeyRepeat:
+    """
+    Repeats the last key pressed while it's held, `delay` secs after it was pressed and then `rate` times a sec.
+    The repeats are timed by the clock instead of by frames, so they're the same speed however fast the main loop goes,
+    and the main loop only gets woken (by `sched`, if given) when one is due.
+    """
+    def __init__(self, sched=None, delay=0.5, rate=25):
+        self.sched = sched
+        self.delay = delay
+        self.rate = rate
+        self.key = None # The scancode of the key being repeated
+        self.next = None # The time.time() the next repeat is due
+        self.timer = None
+    
+    def press(self, ev):
+        if ev.scancode in _MOD_KEYS:
+            return
+        self.key = ev.scancode
+        self._schedule(ev.timestamp+self.delay)
+    
+    def release(self, ev):
+        if ev.scancode == self.key:
+            self.key = None
+            self._schedule(None)
+    
+    def restart(self):
+        """Waits the whole delay again before the next repeat, like the key was just pressed"""
+        if self.key is not None:
+            self._schedule(time.time()+self.delay)
+    
+    def due(self, now):
+        """Gets how many repeats of the key have come due by `now`"""
+        if self.key is None or now < self.next:
+            return 0
+        n = int((now-self.next)*self.rate)+1
+        self._schedule(self.next+n/self.rate)
+        return n
+    
+    def _schedule(self, when):
+        self.next = when
+        if self.sched is not None:
+            if self.timer is not None:
+                self.sched.cancel(self.timer)
+            self.timer = None if when is None else self.sched.callAt(when)
+
+# The wire format for key events from the reader process: scancode, state, modifier bits, kernel timestamp
+_EVENT = struct.Struct('=HBBd')
 
 class KbdInp:
-    def __init__(self):
-        self.fd = ''
-        self.pipe, child = Pipe()
-        self.pro = Process(target=self.getInp, args=(child,), daemon=True)
-        self.pro.start()
+    def __init__(self, inProcess=False, repeat=None, sched=None):
+        """
+        Reads the keyboard in a separate process, or if `inProcess` straight from the evdev device (which saves the process but needs to be called often).
+        Held keys repeat with `repeat` (a KeyRepeat), instead of with the kernel's repeats. If `sched` is given, it wakes the main loop when there's input.
+        """
         self.events = {}
+        self.repeat = KeyRepeat() if repeat is None else repeat
+        self.sched = sched
+        self._pending = b''
+        self._deferred = [] # Events held back to the next frame, so a quick tap's press isn't lost under its release
+        self._mods = Mods(0)
+        if inProcess:
+            self.device = find_keyboard()
+            self.fd = self.device.fd
+            self.pro = None
+        else:
+            self.device = None
+            self.fd, child = os.pipe()
+            self.pro = Process(target=self.getInp, args=(child,), daemon=True)
+            self.pro.start()
+            os.close(child)
+            os.set_blocking(self.fd, False)
+        if sched is not None:
+            sched.addReader(self)
+    
+    def fileno(self):
+        return self.fd
     
     @staticmethod
-    def getInp(pipe):
+    def getInp(fd):
         device = find_keyboard()
-        modifs = {
-            'shift': False,
-            'ctrl': False,
-            'alt': False,
-            'super': False,
-        }
-
+        mods = 0
+        batch = []
         while True:
             try:
                 for event in device.read_loop():
                     if event.type == ecodes.EV_KEY:
-                        key_event = categorize(event)
-
-                        if key_event.scancode in (ecodes.KEY_LEFTMETA, ecodes.KEY_RIGHTMETA): # Super
-                            modifs['super'] = False
-                            pipe.send(Key(key_event.scancode, key_event.keystate, modifs))
-                            modifs['super'] = key_event.keystate != 0 # 1 = Pressed, 0 = Released, 2 = Hold
-                        elif key_event.scancode in (ecodes.KEY_LEFTALT, ecodes.KEY_RIGHTALT): # Alt
-                            modifs['alt'] = False
-                            pipe.send(Key(key_event.scancode, key_event.keystate, modifs))
-                            modifs['alt'] = key_event.keystate != 0
-                        elif key_event.scancode in (ecodes.KEY_LEFTCTRL, ecodes.KEY_RIGHTCTRL): # Ctrl
-                            modifs['ctrl'] = False
-                            pipe.send(Key(key_event.scancode, key_event.keystate, modifs))
-                            modifs['ctrl'] = key_event.keystate != 0
-                        elif key_event.scancode in (ecodes.KEY_LEFTSHIFT, ecodes.KEY_RIGHTSHIFT): # Shift
-                            modifs['shift'] = False
-                            pipe.send(Key(key_event.scancode, key_event.keystate, modifs))
-                            modifs['shift'] = key_event.keystate != 0
-                        else:
-                            pipe.send(Key(key_event.scancode, key_event.keystate, modifs))
+                        send, mods = _trackMods(mods, event.code, event.value)
+                        batch.append(_EVENT.pack(event.code, event.value, send, event.timestamp()))
+                    elif event.type == ecodes.EV_SYN and batch: # Send everything that happened at once together
+                        os.write(fd, b''.join(batch))
+                        batch = []
             except KeyboardInterrupt:
-                pipe.send(Key(ecodes.KEY_C, 1, modifs))
+                os.write(fd, _EVENT.pack(ecodes.KEY_C, 1, mods, time.time()))
+    
+    def _recv(self):
+        """Gets all the key events that have come in since last time"""
+        if self.device is not None:
+            out = []
+            try:
+                for event in self.device.read():
+                    if event.type == ecodes.EV_KEY:
+                        send, self._mods = _trackMods(self._mods, event.code, event.value)
+                        out.append(Key(event.code, event.value, send, event.timestamp()))
+            except BlockingIOError:
+                pass
+            return out
+        
+        data = self._pending
+        try:
+            while True:
+                chunk = os.read(self.fd, _EVENT.size*256)
+                if not chunk: # The reader process is gone, and the pipe would look readable forever
+                    self._closePipe()
+                    raise RuntimeError(f'The keyboard reader process exited (exit code {self.pro.exitcode})')
+                data += chunk
+        except BlockingIOError:
+            pass
+        end = len(data) - len(data) % _EVENT.size
+        self._pending = data[end:]
+        return [Key(code, state, Mods(mods), ts) for code, state, mods, ts in _EVENT.iter_unpack(data[:end])]
+    
+    def _closePipe(self):
+        if self.sched is not None:
+            self.sched.removeReader(self)
+        os.close(self.fd)
+        self.pro.join(1)
     
     def handleQueue(self):
         for ev in list(self.events.keys()):
+            self.events[ev].repeats = 0
             if self.events[ev].state == 0:
                 self.events.pop(ev)
             elif self.events[ev].state == 1:
                 self.events[ev].state = 2
-        while self.pipe.poll():
-            nev = self.pipe.recv()
-            if nev.scancode in self.events and nev == self.events[nev.scancode]:
-                nev.startHoldTime = self.events[nev.scancode].startHoldTime
-                nev.heldFrames = self.events[nev.scancode].heldFrames + 1
+        incoming, self._deferred = self._deferred+self._recv(), []
+        deferring = set() # Keys with events held back, so everything after for them has to wait too
+        for nev in incoming:
+            old = self.events.get(nev.scancode)
+            if nev.scancode in deferring or (nev.state == 0 and old is not None and old.state == 1):
+                # Pressed and let go between frames, so let go next frame instead of the release replacing the press
+                self._deferred.append(nev)
+                deferring.add(nev.scancode)
+                continue
+            if nev.state == 2 and old is not None: # The kernel's own repeats, which KeyRepeat does instead
+                old.setMods(nev.chord.mods) # But the modifiers may have changed since it was pressed
+                continue
+            if nev.scancode in _MOD_KEYS: # Keys already held get repeated with the new modifiers
+                mods = _trackMods(nev.chord.mods, nev.scancode, nev.state)[1]
+                for ev in self.events.values():
+                    if ev.state != 0 and ev.scancode not in _MOD_KEYS:
+                        ev.setMods(mods)
+            if nev.state == 1:
+                self.repeat.press(nev)
+            elif nev.state == 0:
+                self.repeat.release(nev)
             self.events[nev.scancode] = nev
+        held = self.events.get(self.repeat.key)
+        if held is not None:
+            held.repeats = self.repeat.due(time.time())
+            held.heldFrames += held.repeats
+        if self._deferred and self.sched is not None:
+            self.sched.invalidate() # Make sure there's a next frame to get them
         return list(self.events.values())
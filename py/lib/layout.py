@@ -0,0 +1,34 @@
+__all__ = ['Geometry']
+
+class Geometry:
+    """
+    Where everything in the layout goes at one terminal size, worked out once so every lookup after is O(1).
+    `layout` and `grid` are `TerminalAPI.layout` and `TerminalAPI.grid`; the last row and the last column of each row take up the rest of the space.
+    """
+    def __init__(self, layout, grid, size):
+        self.size = size
+        self.rows = [] # The (y, height) of each row
+        self.cols = [] # For each row, the (x, width) of each column
+        self.apps = {} # Each app in the grid to its (row, column)
+        fixed = sum(h for _, h in layout if h is not None)
+        y = 0
+        for yidx, (widths, h) in enumerate(layout):
+            if h is None:
+                h = size[1]-fixed
+            cols = []
+            x = 0
+            for w in widths+[size[0]-sum(widths)]:
+                cols.append((x, w))
+                x += w
+            self.rows.append((y, h))
+            self.cols.append(cols)
+            for xidx, app in enumerate(grid[yidx]):
+                if app is not None:
+                    self.apps[app] = (yidx, xidx)
+            y += h
+
+    def rect(self, yidx, xidx):
+        """Gets the (x, y, width, height) of a spot in the grid"""
+        x, w = self.cols[yidx][xidx]
+        y, h = self.rows[yidx]
+        return x, y, w, h
@@ -0,0 +1,98 @@
+from collections import deque
+import os
+import time
+
+__all__ = ['Profiler']
+
+class _Section:
+    __slots__ = ('prof', 'name', 'start')
+    def __init__(self, prof, name):
+        self.prof = prof
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *args):
+        self.prof.add(self.name, time.perf_counter()-self.start)
+
+class _NoSection:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *args):
+        pass
+
+_NO_SECTION = _NoSection()
+
+class Profiler:
+    """Times the parts of each frame while enabled, keeping the last `window` times of each and optionally writing every one to a CSV trace"""
+    def __init__(self, window=60):
+        self.enabled = False
+        self.window = window
+        self.traceFile = None # A CSV file to append `frame,section,ms` rows to while enabled
+        self.times = {}
+        self.watching = {} # Name to a function giving a running total, like cache hits, to show the change in each frame
+        self.counts = {}
+        self._totals = {}
+        self.frame = 0
+        self._rows = []
+        self._trace = None
+
+    def toggle(self):
+        self.enabled = not self.enabled
+        if self.enabled:
+            self.times = {}
+            self.counts = {}
+            self._totals = {name: total() for name, total in self.watching.items()}
+            if self.traceFile is not None:
+                new = not os.path.exists(self.traceFile)
+                self._trace = open(self.traceFile, 'a')
+                if new:
+                    self._trace.write('frame,section,ms\n')
+        elif self._trace is not None:
+            self._trace.close()
+            self._trace = None
+
+    def section(self, name):
+        """Gets a context manager that times its body as `name`. Does nothing when disabled."""
+        if not self.enabled:
+            return _NO_SECTION
+        return _Section(self, name)
+
+    def watch(self, name, total):
+        """Shows how much `total()` goes up by each frame while enabled"""
+        self.watching[name] = total
+    
+    def add(self, name, secs):
+        if not self.enabled:
+            return
+        if name not in self.times:
+            self.times[name] = deque(maxlen=self.window)
+        self.times[name].append(secs)
+        if self._trace is not None:
+            self._rows.append(f'{self.frame},{name},{secs*1000:.3f}\n')
+
+    def endFrame(self):
+        if not self.enabled:
+            return
+        self.frame += 1
+        for name, total in self.watching.items():
+            now = total()
+            if name not in self.counts:
+                self.counts[name] = deque(maxlen=self.window)
+            self.counts[name].append(now-self._totals.get(name, now))
+            self._totals[name] = now
+        if self._rows:
+            self._trace.writelines(self._rows)
+            self._rows = []
+
+    def lines(self):
+        """Gets the overlay text: the average and worst time of each section, and count per frame of each watched total, over the window"""
+        width = max((len(name) for name in (*self.times, *self.counts)), default=0)
+        out = [f'{"":{width}}    avg    max']
+        for name, times in self.times.items():
+            out.append(f'{name:{width}} {sum(times)/len(times)*1000:5.2f}ms {max(times)*1000:5.2f}ms')
+        for name, counts in self.counts.items():
+            out.append(f'{name:{width}} {sum(counts)/len(counts):7.1f} {max(counts):6}')
+        return out
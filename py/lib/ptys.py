@@ -0,0 +1,159 @@
+"""
+One thread that does the I/O for every terminal's pseudo-terminal, so any number of terminals only cost their shells.
+
+It waits on all the pty masters (and stdin, while a terminal has focus) in one selector with no timeout, so it only wakes when there's something to do.
+Output goes into each terminal's `ByteRing` and wakes the main loop. Everything else is sent to the thread as a command,
+so only the thread ever touches the file descriptors.
+"""
+from collections import deque
+import fcntl
+import os
+import pty
+import selectors
+import signal
+import struct
+import subprocess
+import sys
+import termios
+import threading
+from lib.render import SYNC_REPLY
+
+__all__ = ['PtyMux', 'Pty']
+
+def _setSize(fd, width, height):
+    fcntl.ioctl(fd, termios.TIOCSWINSZ, struct.pack("HHHH", height, width, 0, 0))
+
+class Pty:
+    """A command running in a pseudo-terminal, whose output gets put in `ring`. Made by `PtyMux.open`."""
+    def __init__(self, mux, cmd, width, height, ring):
+        self.mux = mux
+        self.ring = ring
+        self.paused = False # Whether output has stopped being read because the ring is full
+        self.fd, slave = pty.openpty()
+        _setSize(slave, width, height)
+        self.proc = subprocess.Popen([cmd, '-i'], stdin=slave, stdout=slave, stderr=slave, start_new_session=True)
+        os.close(slave)
+
+    def resize(self, width, height):
+        self.mux._send(self.mux._resize, self, width, height)
+
+    def focus(self, focus):
+        self.mux._send(self.mux._focus, self, focus)
+
+    def resume(self):
+        """Starts reading output again if it stopped because the ring filled up. Call after taking output out of the ring."""
+        if self.paused:
+            self.mux._send(self.mux._resume, self)
+
+    def close(self):
+        """Hangs up on the command"""
+        self.mux._send(self.mux._close, self)
+
+class PtyMux:
+    def __init__(self, wake):
+        self.wake = wake # Called whenever there's new output
+        self.selector = selectors.DefaultSelector()
+        self.commands = deque()
+        self.focused = None
+        self.reaping = [] # Commands that have been hung up on but haven't finished exiting yet
+        self.stdin = sys.stdin.fileno()
+        self._wakeR, self._wakeW = os.pipe()
+        os.set_blocking(self._wakeR, False)
+        os.set_blocking(self._wakeW, False)
+        self.selector.register(self._wakeR, selectors.EVENT_READ, self._runCommands)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def open(self, cmd, width, height, ring):
+        """Starts `cmd` in a new pseudo-terminal of the size given, with its output going to `ring`"""
+        p = Pty(self, cmd, width, height, ring)
+        self._send(self._add, p)
+        return p
+
+    def _send(self, func, *args):
+        self.commands.append((func, args))
+        try:
+            os.write(self._wakeW, b'\0')
+        except BlockingIOError: # The thread already has plenty of wakeups waiting
+            pass
+
+    # Everything below here is only run on the thread
+    def _run(self):
+        while True:
+            for key, _ in self.selector.select(0.1 if self.reaping else None):
+                key.data()
+            self.reaping = [proc for proc in self.reaping if proc.poll() is None]
+
+    def _runCommands(self):
+        try:
+            while os.read(self._wakeR, 512):
+                pass
+        except BlockingIOError:
+            pass
+        while self.commands:
+            func, args = self.commands.popleft()
+            func(*args)
+
+    def _add(self, p):
+        self.selector.register(p.fd, selectors.EVENT_READ, lambda: self._read(p))
+
+    def _read(self, p):
+        try:
+            n = p.ring.readFrom(p.fd)
+        except OSError: # EIO once the command has exited
+            n = 0
+        if n is None: # Leave the output in the pty until the ring has room, which makes the command wait
+            p.paused = True
+            self.selector.unregister(p.fd)
+            if p.ring.free: # It got emptied before it was marked paused, so nothing will resume it
+                self._resume(p)
+            return
+        if n == 0:
+            self._close(p)
+        self.wake()
+
+    def _resume(self, p):
+        if p.paused and p.fd is not None:
+            p.paused = False
+            self.selector.register(p.fd, selectors.EVENT_READ, lambda: self._read(p))
+
+    def _resize(self, p, width, height):
+        if p.fd is not None:
+            _setSize(p.fd, width, height)
+
+    def _focus(self, p, focus):
+        if focus:
+            new = p if p.fd is not None else None
+        else:
+            new = None if self.focused is p else self.focused
+        if (new is None) != (self.focused is None): # Only read stdin while a terminal wants it
+            try:
+                if new is None:
+                    self.selector.unregister(self.stdin)
+                else:
+                    self.selector.register(self.stdin, selectors.EVENT_READ, self._forwardInput)
+            except (KeyError, OSError): # stdin is something that can't be waited on, like a file, so there's never any input
+                pass
+        self.focused = new
+
+    def _forwardInput(self):
+        data = SYNC_REPLY.sub(b'', os.read(self.stdin, 1024)) # A reply that came after the renderer stopped waiting for it isn't typing
+        if data and self.focused is not None:
+            os.write(self.focused.fd, data)
+
+    def _close(self, p):
+        if p.fd is None:
+            return
+        self._focus(p, False)
+        if not p.paused:
+            self.selector.unregister(p.fd)
+        os.close(p.fd)
+        p.fd = None
+        p.ring.close()
+        if p.proc.poll() is None:
+            try:
+                os.killpg(p.proc.pid, signal.SIGHUP)
+            except ProcessLookupError:
+                pass
+            self.reaping.append(p.proc)
+        self.wake()
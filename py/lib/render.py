@@ -0,0 +1,177 @@
+import lib.sgr as sgr
+import os
+import re
+import select
+import sys
+import time
+
+__all__ = ['Renderer', 'SYNC_REPLY']
+
+_BLANK = 32 # A space
+_SYNC_START = b'\033[?2026h' # Synchronized output, so the terminal doesn't show half drawn frames
+_SYNC_END = b'\033[?2026l'
+SYNC_REPLY = re.compile(rb'\033\[\?2026;(\d)\$y') # The terminal's answer to asking about synchronized output, which can come late (so input has to filter it out)
+
+def _utf8Len(cp):
+    if cp < 0x80:
+        return 1
+    if cp < 0x800:
+        return 2
+    if cp < 0x10000:
+        return 3
+    return 4
+
+class Renderer:
+    """Draws screens to the terminal, only sending the cells that changed since the last frame"""
+    def __init__(self, fd=None, syncOutput=False):
+        self.fd = sys.stdout.fileno() if fd is None else fd
+        self.syncOutput = syncOutput
+        self.frameBytes = 0 # How many bytes the last frame took to draw
+        self.totalBytes = 0
+        self.frames = 0
+        self.flushTime = 0 # How long the last frame took to write, in seconds
+        self._buf = bytearray(1 << 16) # Each frame is built up in here and written all at once
+        self._len = 0
+        self._cursor = None # Where the terminal's cursor is, or None if unknown
+        self._pen = None # The terminal's current style, kept across frames so only changes get sent. None if unknown.
+
+    def querySyncOutput(self, inFd, timeout=0.1):
+        """Asks the terminal (which must be in raw mode) whether it supports synchronized output, and turns it on if it does"""
+        os.write(self.fd, b'\033[?2026$p')
+        resp = b''
+        end = time.time()+timeout
+        while not resp.endswith(b'$y') and time.time() < end:
+            if select.select([inFd], [], [], max(end-time.time(), 0))[0]:
+                resp += os.read(inFd, 64)
+        match = SYNC_REPLY.search(resp)
+        self.syncOutput = match is not None and match.group(1) in (b'1', b'2')
+        return self.syncOutput
+
+    def _put(self, data):
+        end = self._len+len(data)
+        if end > len(self._buf):
+            self._buf.extend(bytes(max(end-len(self._buf), len(self._buf))))
+        self._buf[self._len:end] = data
+        self._len = end
+
+    def _flush(self):
+        """Writes the frame to the terminal in (usually) one syscall"""
+        view = memoryview(self._buf)[:self._len]
+        try:
+            while view:
+                try:
+                    view = view[os.write(self.fd, view):]
+                except BlockingIOError:
+                    select.select([], [self.fd], [])
+        finally:
+            view.release()
+
+    def _moveTo(self, x, y):
+        if self._cursor == (x, y):
+            return
+        if self._cursor is not None and self._cursor[1] == y and x > self._cursor[0]:
+            n = x-self._cursor[0]
+            self._put(b'\033[C' if n == 1 else b'\033[%dC' % n)
+        else:
+            self._put(b'\033[%d;%dH' % (y+1, x+1) if x else b'\033[%dH' % (y+1))
+        self._cursor = (x, y)
+
+    def _gapCost(self, screen, off, start, end):
+        """How many more bytes it takes to rewrite the unchanged cells from start to end than to skip over them (not counting the move)"""
+        cost = 0
+        before = style = screen.styles[off+start-1]
+        for x in range(start, end):
+            if screen.styles[off+x] != style:
+                cost += len(sgr.transition(style, screen.styles[off+x]))
+                style = screen.styles[off+x]
+            cost += _utf8Len(screen.chars[off+x])
+        after = screen.styles[off+end]
+        return cost + len(sgr.transition(style, after)) - len(sgr.transition(before, after))
+
+    def _spans(self, new, old, y):
+        """Gets the [start, end) spans of row y that changed, joining spans that are cheaper to rewrite the gap between than to skip over it"""
+        w = new.width
+        off = y*w
+        end = w if y < new.height-1 else w-1 # Writing the bottom-right corner can scroll the terminal
+        newC, newS, oldC, oldS = new.chars, new.styles, old.chars, old.styles
+        spans = []
+        x = 0
+        while x < end:
+            if newC[off+x] != oldC[off+x] or newS[off+x] != oldS[off+x]:
+                start = x
+                while x < end and (newC[off+x] != oldC[off+x] or newS[off+x] != oldS[off+x]):
+                    x += 1
+                if spans:
+                    gap = start-spans[-1][1]
+                    if self._gapCost(new, off, spans[-1][1], start) <= len(f'\033[{gap}C'):
+                        spans[-1][1] = x
+                        continue
+                spans.append([start, x])
+            else:
+                x += 1
+        return spans
+
+    def _writeSpan(self, screen, y, start, end):
+        off = y*screen.width
+        txt = screen.chars[off+start:off+end].tobytes().decode('utf-32-le')
+        styles = screen.styles
+        runStart = 0
+        for idx in range(end-start):
+            if styles[off+start+idx] != self._pen:
+                self._put(txt[runStart:idx].encode())
+                self._put(sgr.transition(self._pen, styles[off+start+idx]).encode())
+                self._pen = styles[off+start+idx]
+                runStart = idx
+        self._put(txt[runStart:].encode())
+        self._cursor = (end, y) if end < screen.width else None # Writing the last column leaves the cursor in limbo
+
+    def _blankFrom(self, screen, y):
+        """Gets the x that row y is blank from to the end of the row"""
+        off = y*screen.width
+        x = screen.width
+        while x > 0 and screen.chars[off+x-1] == _BLANK and screen.styles[off+x-1] == sgr.DEFAULT:
+            x -= 1
+        return x
+
+    def render(self, new, old, clear=False):
+        """Draws the screen `new` over the terminal which is currently showing `old`. If `clear`, the terminal is cleared first and `old` should be blank."""
+        self._len = 0
+        if self.syncOutput:
+            self._put(_SYNC_START)
+        if clear:
+            self._put(b'\033[0m\033[H\033[2J')
+            self._pen, self._cursor = sgr.DEFAULT, (0, 0)
+        for y in range(new.height):
+            if new.SameRow(old, y):
+                continue
+            spans = self._spans(new, old, y)
+            if not spans:
+                continue
+            rowEnd = new.width if y < new.height-1 else new.width-1
+            blank = self._blankFrom(new, y)
+            for start, end in spans:
+                if end >= rowEnd and rowEnd-blank > len('\033[K'):
+                    # Erase to the end of the line instead of writing all the blanks
+                    if start < blank:
+                        self._moveTo(start, y)
+                        self._writeSpan(new, y, start, blank)
+                    self._moveTo(max(start, blank), y)
+                    if self._pen != sgr.DEFAULT:
+                        self._put(sgr.transition(self._pen, sgr.DEFAULT).encode())
+                        self._pen = sgr.DEFAULT
+                    self._put(b'\033[K')
+                else:
+                    self._moveTo(start, y)
+                    self._writeSpan(new, y, start, end)
+
+        if self._len == len(_SYNC_START)*self.syncOutput: # Nothing changed
+            self._len = 0
+        elif self.syncOutput:
+            self._put(_SYNC_END)
+        start = time.perf_counter()
+        self._flush()
+        self.flushTime = time.perf_counter()-start
+        self.frameBytes = self._len
+        self.totalBytes += self.frameBytes
+        self.frames += 1
+        return self.frameBytes
@@ -0,0 +1,71 @@
+import mmap
+import os
+import struct
+
+__all__ = ['ByteRing']
+
+# The header: how many bytes have ever been written, how many have ever been read, and whether the writer has finished
+_HEADER = struct.Struct('=QQQ')
+_WRITTEN, _READ, _CLOSED = 0, 8, 16
+
+class ByteRing:
+    """
+    A single producer, single consumer byte queue in shared memory, with no locks.
+    Make it before forking; then one process only writes and the other only reads.
+    Each side only ever changes its own counter, after the data it covers, so neither can see a half written chunk.
+    """
+    def __init__(self, size=1 << 20):
+        if size & (size-1):
+            raise ValueError(f'Ring size must be a power of 2, found {size}!')
+        self.size = size
+        self.mem = mmap.mmap(-1, _HEADER.size+size) # Anonymous maps are shared with forked processes
+        self.data = memoryview(self.mem)[_HEADER.size:]
+
+    def _get(self, offset):
+        return struct.unpack_from('=Q', self.mem, offset)[0]
+
+    def _set(self, offset, value):
+        struct.pack_into('=Q', self.mem, offset, value)
+
+    def __len__(self):
+        """How many bytes are waiting to be read"""
+        return self._get(_WRITTEN)-self._get(_READ)
+
+    @property
+    def free(self):
+        return self.size-len(self)
+
+    @property
+    def closed(self):
+        return bool(self._get(_CLOSED))
+
+    # Producer side
+    def readFrom(self, fd):
+        """Reads from `fd` straight into the free space, returning how many bytes were read (0 on EOF) or None if the ring is full"""
+        written = self._get(_WRITTEN)
+        free = self.size-(written-self._get(_READ))
+        if free == 0:
+            return None
+        start = written & (self.size-1)
+        n = os.readv(fd, [self.data[start:min(start+free, self.size)]])
+        self._set(_WRITTEN, written+n)
+        return n
+
+    def close(self):
+        self._set(_CLOSED, 1)
+
+    # Consumer side
+    def read(self, maxBytes=None):
+        """Takes up to `maxBytes` (default everything) waiting bytes out of the ring"""
+        read = self._get(_READ)
+        n = self._get(_WRITTEN)-read
+        if maxBytes is not None:
+            n = min(n, maxBytes)
+        start = read & (self.size-1)
+        end = start+n
+        if end <= self.size:
+            out = bytes(self.data[start:end])
+        else:
+            out = bytes(self.data[start:])+bytes(self.data[:end-self.size])
+        self._set(_READ, read+n)
+        return out
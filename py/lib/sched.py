@@ -0,0 +1,105 @@
+import heapq
+import itertools
+import os
+import selectors
+import time
+
+__all__ = ['Scheduler']
+
+_CANCELLED = object()
+
+class Scheduler:
+    """Waits on file descriptors and timers together so the main loop only wakes when something can have changed"""
+    def __init__(self, maxFPS=30):
+        self.maxFPS = maxFPS
+        self.dirty = True
+        self.lastFrame = 0
+        self.selector = selectors.DefaultSelector()
+        self.timers = []
+        self._wakes = {} # (time, callback) to the timer for it, for wakeAt
+        self._ids = itertools.count()
+        self._wakeR, self._wakeW = os.pipe()
+        os.set_blocking(self._wakeR, False)
+        os.set_blocking(self._wakeW, False)
+        self.selector.register(self._wakeR, selectors.EVENT_READ, self._drainWake)
+
+    def addReader(self, fileobj, callback=None):
+        """Wakes the main loop (and calls `callback` if given) whenever `fileobj` is readable"""
+        self.selector.register(fileobj, selectors.EVENT_READ, callback)
+
+    def removeReader(self, fileobj):
+        try:
+            self.selector.unregister(fileobj)
+        except (KeyError, ValueError):
+            pass
+
+    def callAt(self, when, callback=None):
+        """Runs `callback` (or just wakes the main loop if None) at the time.time() `when`. Returns a handle for `cancel`."""
+        timer = [when, next(self._ids), callback, None] # The last item is its key in self._wakes, if wakeAt made it
+        heapq.heappush(self.timers, timer)
+        return timer
+
+    def callLater(self, delay, callback=None):
+        return self.callAt(time.time()+delay, callback)
+
+    def wakeAt(self, when, callback=None):
+        """Like `callAt`, but only schedules one call per distinct time and callback, so it can be called every frame for the same deadline"""
+        key = (when, callback)
+        if key not in self._wakes:
+            self._wakes[key] = self.callAt(when, callback)
+            self._wakes[key][3] = key
+        return self._wakes[key]
+
+    def cancel(self, timer):
+        timer[2] = _CANCELLED
+        if timer[3] is not None:
+            self._wakes.pop(timer[3], None)
+
+    def invalidate(self):
+        """Marks the screen as needing to be redrawn"""
+        self.dirty = True
+
+    def wake(self):
+        """Wakes the main loop from another thread or a signal handler"""
+        try:
+            os.write(self._wakeW, b'\0')
+        except BlockingIOError:
+            pass
+
+    def _drainWake(self):
+        try:
+            while os.read(self._wakeR, 512):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _runTimers(self):
+        now = time.time()
+        while self.timers and self.timers[0][0] <= now:
+            when, _, callback, wake = heapq.heappop(self.timers)
+            if callback is _CANCELLED:
+                continue
+            if wake is not None:
+                del self._wakes[wake]
+            self.dirty = True
+            if callback is not None:
+                callback()
+
+    def wait(self):
+        """Blocks until the next frame needs to be drawn, capping the frame rate at `self.maxFPS`"""
+        self._runTimers()
+        while not self.dirty:
+            timeout = None
+            if self.timers:
+                timeout = max(self.timers[0][0] - time.time(), 0)
+            for key, _ in self.selector.select(timeout):
+                self.dirty = True
+                if key.data is not None:
+                    key.data()
+            self._runTimers()
+
+        delay = self.lastFrame + 1/self.maxFPS - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self.lastFrame = time.monotonic()
+        self.dirty = False
@@ -0,0 +1,175 @@
+"""
+Styles (SGR pen states) for the screen buffers.
+
+A style is stored in the screen as a small int id which indexes an interned pen tuple of
+`(attribute bitmask, foreground, background)`, where the colours are the SGR parameters that set them (e.g. `'34'` or `'38;5;202'`) or None for the terminal default.
+Pens are never forgotten (the ids are kept in screens), so only `_MAX_PENS` of them can have colours. Past that, new pens get the same
+with truecolour rounded to the 256 colour palette if that's already interned, or else just the attributes (of which there are only 256).
+"""
+
+__all__ = [
+    'DEFAULT',
+    'pen',
+    'apply',
+    'encode',
+    'transition',
+]
+
+DEFAULT = 0
+
+# Attribute bit for each SGR parameter that turns one on
+_ATTR_ON = {
+    1: 1 << 0, # Bold
+    2: 1 << 1, # Dim
+    3: 1 << 2, # Italic
+    4: 1 << 3, # Underline
+    5: 1 << 4, # Blink
+    7: 1 << 5, # Reverse
+    8: 1 << 6, # Hidden
+    9: 1 << 7, # Strikethrough
+}
+# Attribute bits for each SGR parameter that turns some off
+_ATTR_OFF = {
+    22: (1 << 0) | (1 << 1),
+    23: 1 << 2,
+    24: 1 << 3,
+    25: 1 << 4,
+    27: 1 << 5,
+    28: 1 << 6,
+    29: 1 << 7,
+}
+
+_PENS = [(0, None, None)]
+_PEN_IDS = {_PENS[0]: DEFAULT}
+
+_MAX_PENS = 1 << 16
+
+def _to256(col):
+    """Rounds a truecolour (`38;2;r;g;b`) to the nearest in the 256 colour cube"""
+    if col is None or not col[3:].startswith('2;'):
+        return col
+    try:
+        r, g, b = ((min(int(c), 255)*5+127)//255 for c in col[5:].split(';'))
+    except ValueError:
+        return col
+    return f'{col[:2]};5;{16 + 36*r + 6*g + b}'
+
+def _intern(pen):
+    if pen in _PEN_IDS:
+        return _PEN_IDS[pen]
+    attrs, fg, bg = pen
+    if len(_PENS) >= _MAX_PENS and (fg is not None or bg is not None): # Full, so use the nearest pen already there
+        near = (attrs, _to256(fg), _to256(bg))
+        if near in _PEN_IDS:
+            return _PEN_IDS[near]
+        return _intern((attrs, None, None))
+    _PEN_IDS[pen] = len(_PENS)
+    _PENS.append(pen)
+    return _PEN_IDS[pen]
+
+def pen(style):
+    """Gets the `(attributes, foreground, background)` tuple for a style id"""
+    return _PENS[style]
+
+_APPLY_CACHE = {}
+_MAX_CACHE = 4096
+def apply(style, seq):
+    """Gets the style id after the escape sequence `seq` is written with the pen at `style`. Non-SGR sequences don't change the style."""
+    key = (style, seq)
+    if key in _APPLY_CACHE:
+        return _APPLY_CACHE[key]
+    if not (seq.startswith('\033[') and seq.endswith('m')):
+        return style
+
+    attrs, fg, bg = _PENS[style]
+    params = seq[2:-1].split(';')
+    idx = 0
+    while idx < len(params):
+        p = params[idx]
+        p = int(p) if p.isdigit() else 0
+        if p == 0:
+            attrs, fg, bg = 0, None, None
+        elif p in _ATTR_ON:
+            attrs |= _ATTR_ON[p]
+        elif p in _ATTR_OFF:
+            attrs &= ~_ATTR_OFF[p]
+        elif 30 <= p <= 37 or 90 <= p <= 97:
+            fg = str(p)
+        elif 40 <= p <= 47 or 100 <= p <= 107:
+            bg = str(p)
+        elif p == 39:
+            fg = None
+        elif p == 49:
+            bg = None
+        elif p in (38, 48):
+            # Extended colours: 38;5;n or 38;2;r;g;b
+            n = 3 if params[idx+1:idx+2] == ['5'] else 5
+            col = ';'.join(params[idx:idx+n])
+            idx += n-1
+            if p == 38:
+                fg = col
+            else:
+                bg = col
+        idx += 1
+
+    out = _intern((attrs, fg, bg))
+    if len(_APPLY_CACHE) > _MAX_CACHE:
+        _APPLY_CACHE.clear()
+    _APPLY_CACHE[key] = out
+    return out
+
+def _params(style):
+    attrs, fg, bg = _PENS[style]
+    out = [str(p) for p, bit in _ATTR_ON.items() if attrs & bit]
+    if fg is not None:
+        out.append(fg)
+    if bg is not None:
+        out.append(bg)
+    return out
+
+def encode(style):
+    """Gets the escape sequence that sets the pen from the default to `style`"""
+    if style == DEFAULT:
+        return ''
+    return f'\033[{";".join(_params(style))}m'
+
+_TRANSITIONS = {}
+def transition(old, new):
+    """Gets the shortest escape sequence that changes the pen from `old` to `new`. `old` can be None if the pen is unknown."""
+    if old == new:
+        return ''
+    key = (old, new)
+    if key in _TRANSITIONS:
+        return _TRANSITIONS[key]
+    if new == DEFAULT:
+        out = '\033[0m'
+    else:
+        out = f'\033[0;{";".join(_params(new))}m'
+        if old is not None:
+            delta = _delta(old, new)
+            if len(delta) < len(out):
+                out = delta
+    if len(_TRANSITIONS) > _MAX_CACHE:
+        _TRANSITIONS.clear()
+    _TRANSITIONS[key] = out
+    return out
+
+def _delta(old, new):
+    """Gets the escape sequence that changes the pen from `old` to `new` without resetting it"""
+    oattrs, ofg, obg = _PENS[old]
+    nattrs, nfg, nbg = _PENS[new]
+    params = []
+    removed = oattrs & ~nattrs
+    for p, bits in _ATTR_OFF.items():
+        if removed & bits:
+            params.append(str(p))
+            removed &= ~bits
+            oattrs &= ~bits # 22 turns off both bold and dim, so if one should stay it gets turned back on below
+    for p, bit in _ATTR_ON.items():
+        if nattrs & bit and not oattrs & bit:
+            params.append(str(p))
+    if nfg != ofg:
+        params.append(nfg or '39')
+    if nbg != obg:
+        params.append(nbg or '49')
+    return f'\033[{";".join(params)}m'
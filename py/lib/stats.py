@@ -0,0 +1,126 @@
+"""
+Performance statistics.
+
+Samples are counted into log spaced buckets so a histogram takes the same memory however long the OS runs,
+and any percentile can be read back to within a few percent.
+"""
+import math
+import time
+
+__all__ = [
+    'Histogram',
+    'Rate',
+    'histogram',
+    'rate',
+    'report',
+    'dump',
+]
+
+_MIN = 1e-5 # Samples smaller than this (in seconds) all go in the first bucket
+_GROWTH = 1.05 # Each bucket is this much wider than the one before
+_LOG_GROWTH = math.log(_GROWTH)
+
+def _ms(secs):
+    return f'{secs*1000:.1f}ms'
+
+class Histogram:
+    def __init__(self, name):
+        self.name = name
+        self.reset()
+
+    def reset(self):
+        self.buckets = []
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, value):
+        """Adds a sample in seconds"""
+        idx = int(math.log(value/_MIN)/_LOG_GROWTH) if value > _MIN else 0
+        if idx >= len(self.buckets):
+            self.buckets.extend([0]*(idx+1-len(self.buckets)))
+        self.buckets[idx] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        """Gets the (upper bound of the) value that p% of samples are at or under"""
+        if not self.count:
+            return 0
+        need = math.ceil(self.count*p/100)
+        seen = 0
+        for idx, n in enumerate(self.buckets):
+            seen += n
+            if seen >= need:
+                return min(_MIN*_GROWTH**(idx+1), self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total/self.count if self.count else 0
+
+    def summary(self):
+        if not self.count:
+            return f'{self.name}: no samples'
+        return f'{self.name}: n={self.count} p50={_ms(self.percentile(50))} p95={_ms(self.percentile(95))} ' + \
+               f'p99={_ms(self.percentile(99))} max={_ms(self.max)}'
+
+    def __repr__(self):
+        return f'<Histogram {self.summary()}>'
+
+class Rate:
+    """Counts bytes and how many are coming in per second, measured over `window` seconds"""
+    def __init__(self, name, window=1):
+        self.name = name
+        self.window = window
+        self.total = 0
+        self.peak = 0
+        self._rate = 0
+        self._start = time.time()
+        self._count = 0
+
+    def add(self, n):
+        self.total += n
+        self._count += n
+        now = time.time()
+        if now-self._start >= self.window:
+            self._rate = self._count/(now-self._start)
+            self.peak = max(self.peak, self._rate)
+            self._start, self._count = now, 0
+
+    @property
+    def perSec(self):
+        if time.time()-self._start >= self.window*2: # Nothing has come in for a while
+            return 0
+        return self._rate
+
+    def summary(self):
+        return f'{self.name}: {self.total/1e6:.1f}MB total, {self.perSec/1e6:.2f}MB/s now, {self.peak/1e6:.2f}MB/s peak'
+
+    def __repr__(self):
+        return f'<Rate {self.summary()}>'
+
+_STATS = {}
+
+def histogram(name):
+    """Gets the histogram called `name`, making it if it doesn't exist yet"""
+    if name not in _STATS:
+        _STATS[name] = Histogram(name)
+    return _STATS[name]
+
+def rate(name):
+    """Gets the rate counter called `name`, making it if it doesn't exist yet"""
+    if name not in _STATS:
+        _STATS[name] = Rate(name)
+    return _STATS[name]
+
+def report():
+    """Gets a summary line for every histogram and rate"""
+    return '\n'.join(h.summary() for h in _STATS.values())
+
+def dump(path):
+    """Appends the report to the file at `path`"""
+    with open(path, 'a') as f:
+        f.write(f'--- {time.strftime("%Y-%m-%d %H:%M:%S")} ---\n{report()}\n')
@@ -0,0 +1,121 @@
+from bisect import bisect_left
+
+__all__ = ['GapBuffer']
+
+class GapBuffer:
+    """
+    Text being edited at a cursor, where typing, deleting and moving the cursor by a bit are all O(1) (amortized) however long the text is.
+    The characters before the cursor are kept in order and the ones after it in reverse, so the gap between them is at the end of both lists.
+    Where the newlines are is kept the same way, so finding lines never has to look through the text.
+    """
+    def __init__(self, text='', cursor=None):
+        self.before = list(text)
+        self.after = []
+        self.beforeLines = [idx for idx, c in enumerate(text) if c == '\n'] # Where each newline before the cursor is
+        self.afterLines = [] # Where each newline after the cursor is in self.after
+        self.changes = 0 # Goes up on every edit or cursor move, to tell when it's changed
+        if cursor is not None:
+            self.moveTo(cursor)
+
+    def __len__(self):
+        return len(self.before)+len(self.after)
+
+    def __str__(self):
+        return ''.join(self.before)+''.join(reversed(self.after))
+
+    @property
+    def cursor(self):
+        return len(self.before)
+
+    def insert(self, text):
+        """Inserts text (of any length, like a paste) at the cursor, leaving the cursor after it"""
+        start = len(self.before)
+        self.before.extend(text)
+        if '\n' in text:
+            self.beforeLines.extend(start+idx for idx, c in enumerate(text) if c == '\n')
+        self.changes += 1
+
+    def backspace(self, n=1):
+        """Deletes up to n characters before the cursor"""
+        n = min(n, len(self.before))
+        if n:
+            del self.before[-n:]
+            del self.beforeLines[bisect_left(self.beforeLines, len(self.before)):]
+            self.changes += 1
+
+    def delete(self, n=1):
+        """Deletes up to n characters after the cursor"""
+        n = min(n, len(self.after))
+        if n:
+            del self.after[-n:]
+            del self.afterLines[bisect_left(self.afterLines, len(self.after)):]
+            self.changes += 1
+
+    def truncate(self, n):
+        """Cuts the text down to the first n characters"""
+        extra = len(self)-n
+        if extra <= 0:
+            return
+        self.moveTo(min(self.cursor, n))
+        del self.after[:extra]
+        self.afterLines = [idx-extra for idx in self.afterLines if idx >= extra]
+        self.changes += 1
+
+    def moveTo(self, pos):
+        """Moves the cursor to `pos` (kept in the text), which takes as long as how far it moves"""
+        pos = min(max(pos, 0), len(self))
+        if pos < len(self.before):
+            moved = self.before[pos:]
+            del self.before[pos:]
+            end = len(self.after)+len(moved)-1 # Where the character at `pos` ends up in self.after
+            self.after.extend(reversed(moved))
+            cut = bisect_left(self.beforeLines, pos)
+            self.afterLines.extend(end-(idx-pos) for idx in reversed(self.beforeLines[cut:]))
+            del self.beforeLines[cut:]
+        elif pos > len(self.before):
+            start, n = len(self.before), pos-len(self.before)
+            end = len(self.after)-1 # Where the character after the cursor is in self.after
+            self.before.extend(reversed(self.after[-n:]))
+            del self.after[-n:]
+            cut = bisect_left(self.afterLines, len(self.after))
+            self.beforeLines.extend(start+end-idx for idx in reversed(self.afterLines[cut:]))
+            del self.afterLines[cut:]
+        else:
+            return
+        self.changes += 1
+
+    def text(self, start=0, end=None):
+        """Gets the text from `start` to `end` (defaults to the end)"""
+        size = len(self)
+        start, end = max(start, 0), size if end is None else min(end, size)
+        if start >= end:
+            return ''
+        out = ''
+        if start < len(self.before):
+            out = ''.join(self.before[start:min(end, len(self.before))])
+        if end > len(self.before):
+            # Position p after the cursor is at size-1-p in self.after
+            out += ''.join(reversed(self.after[size-end:size-max(start, len(self.before))]))
+        return out
+
+    def line(self):
+        """Gets which line (from 0) the cursor is on"""
+        return len(self.beforeLines)
+
+    def lineCount(self):
+        return len(self.beforeLines)+len(self.afterLines)+1
+
+    def lineStart(self, n):
+        """Gets where line n starts (the end of the text if there aren't that many lines)"""
+        if n <= 0:
+            return 0
+        if n <= len(self.beforeLines):
+            return self.beforeLines[n-1]+1
+        after = n-1-len(self.beforeLines) # Which newline after the cursor it is
+        if after >= len(self.afterLines):
+            return len(self)
+        return len(self)-self.afterLines[-1-after]
+
+    def column(self):
+        """Gets how far the cursor is along its line"""
+        return self.cursor-self.lineStart(self.line())
@@ -0,0 +1,131 @@
+"""
+A streaming parser for the VT100/xterm control sequences that programs write to a terminal.
+
+It is a state machine (ground, escape, CSI, OSC) that keeps its state between calls to `feed`,
+so a sequence split across two reads is still parsed right. Runs of printable text are found with one regex match and handed over whole.
+The parser only splits the stream up; what each part does is up to the screen it is feeding, which needs these methods:
+ - `text(run)` for a run of printable characters
+ - `execute(ch)` for a C0 control character (e.g. `'\\n'`)
+ - `escDispatch(intermediates, final)` for `ESC <intermediates> <final>`
+ - `csiDispatch(private, params, intermediates, final)` for `ESC [ <private> <params> <intermediates> <final>`, where params is a list of ints (0 if left out)
+ - `oscDispatch(data)` for `ESC ] <data> BEL` or `ESC ] <data> ESC \\`
+"""
+import re
+
+__all__ = ['Parser']
+
+GROUND = 0
+ESCAPE = 1
+CSI = 2
+OSC = 3
+OSC_ESC = 4 # An ESC inside an OSC, which is the start of the ST ending it
+CSI_IGNORE = 5 # A CSI that got too long, which is skipped up to its final byte
+
+_MAX_LEN = 256 # Sequences longer than this are garbage, so they get dropped instead of buffered forever
+
+_TEXT = re.compile(r'[^\x00-\x1f\x7f-\x9f]+')
+_CSI_BODY = re.compile(r'[0-?]*[ -/]*')
+_OSC_BODY = re.compile(r'[^\x07\x1b]*')
+
+def _params(txt):
+    private = ''
+    if txt and txt[0] in '<=>?':
+        private, txt = txt[0], txt[1:]
+    if not txt:
+        return private, []
+    return private, [int(p) if p.isdigit() else 0 for p in txt.replace(':', ';').split(';')]
+
+class Parser:
+    def __init__(self, screen):
+        self.screen = screen
+        self.state = GROUND
+        self.buf = '' # The sequence so far, if one has been split between feeds
+
+    def reset(self):
+        self.state = GROUND
+        self.buf = ''
+
+    def feed(self, txt):
+        scr = self.screen
+        idx, end = 0, len(txt)
+        while idx < end:
+            state = self.state
+            if state == GROUND:
+                match = _TEXT.match(txt, idx)
+                if match:
+                    scr.text(match.group())
+                    idx = match.end()
+                    continue
+                ch = txt[idx]
+                idx += 1
+                if ch == '\033':
+                    self.state, self.buf = ESCAPE, ''
+                elif ch < ' ':
+                    scr.execute(ch)
+
+            elif state == ESCAPE:
+                ch = txt[idx]
+                idx += 1
+                if ch == '[':
+                    self.state, self.buf = CSI, ''
+                elif ch == ']':
+                    self.state, self.buf = OSC, ''
+                elif ' ' <= ch <= '/': # Intermediate, the final character is still to come
+                    self.buf += ch
+                elif ch == '\033':
+                    self.buf = ''
+                elif ch < ' ':
+                    scr.execute(ch)
+                else:
+                    self.state = GROUND
+                    scr.escDispatch(self.buf, ch)
+
+            elif state == CSI or state == CSI_IGNORE:
+                match = _CSI_BODY.match(txt, idx)
+                idx = match.end()
+                if state == CSI:
+                    self.buf += match.group()
+                    if len(self.buf) > _MAX_LEN: # Like xterm, drop it instead of buffering it forever
+                        self.state, self.buf = CSI_IGNORE, ''
+                if idx >= end:
+                    break
+                ch = txt[idx]
+                idx += 1
+                if ch < ' ': # Controls still work in the middle of a sequence
+                    if ch == '\033':
+                        self.state, self.buf = ESCAPE, ''
+                    elif ch in '\x18\x1a': # CAN and SUB cancel it
+                        self.state = GROUND
+                    else:
+                        scr.execute(ch)
+                    continue
+                ignored = self.state == CSI_IGNORE
+                self.state = GROUND
+                if '@' <= ch <= '~' and not ignored:
+                    body = self.buf.rstrip(' !"#$%&\'()*+,-./')
+                    private, params = _params(body)
+                    scr.csiDispatch(private, params, self.buf[len(body):], ch)
+
+            elif state == OSC:
+                match = _OSC_BODY.match(txt, idx)
+                if len(self.buf) <= _MAX_LEN:
+                    self.buf += match.group()
+                idx = match.end()
+                if idx >= end:
+                    break
+                ch = txt[idx]
+                idx += 1
+                if ch == '\x07':
+                    self.state = GROUND
+                    scr.oscDispatch(self.buf)
+                else:
+                    self.state = OSC_ESC
+
+            else: # OSC_ESC
+                ch = txt[idx]
+                self.state = GROUND
+                if ch == '\\':
+                    idx += 1
+                    scr.oscDispatch(self.buf)
+                else: # Not an ST, so the OSC got cancelled and this ESC starts something new
+                    self.state, self.buf = ESCAPE, ''
@@ -1,16 +1,13 @@
 import re
-from lib.API import PositionedWidget, SPL, Row, TerminalScreen
-from multiprocessing import Process, Queue
-from queue import Empty
-import math
+import codecs
+import functools
+from lib.API import Clipboard, Container, PositionedWidget, Redraws, SPL, Row, TerminalScreen
+from lib.ring import ByteRing
+from lib.textbuf import GapBuffer
+from lib.ptys import PtyMux
+import lib.stats as stats
 import time
-import os
-import pty
-import select
-import fcntl
-import struct
-import termios
-import sys
+
 
 __all__ = [
     'Text', 
@@ -18,7 +15,23 @@ __all__ = [
     'TextInput'
 ]
 
+LAYOUT_CACHE_SIZE = 512 # How many laid out texts findLines remembers
+
 def findLines(text, max_width):
+    """Splits text into lines (Rows) no wider than `max_width`, wrapping at spaces. The result is cached, so don't change it."""
+    try:
+        return _cachedLines(text, max_width)
+    except TypeError: # Text that can't be hashed, so can't be cached
+        return tuple(_findLines(text, max_width))
+
+@functools.lru_cache(maxsize=LAYOUT_CACHE_SIZE)
+def _cachedLines(text, max_width):
+    return tuple(_findLines(text, max_width))
+
+Container.API.profiler.watch('text layout hits', lambda: _cachedLines.cache_info().hits)
+Container.API.profiler.watch('text layout misses', lambda: _cachedLines.cache_info().misses)
+
+def _findLines(text, max_width):
     text = Row(SPL(text))
     if max_width:
         lines = []
@@ -35,6 +48,8 @@ def findLines(text, max_width):
         return text.split('\n')
 
 class Text(PositionedWidget):
+    text = Redraws()
+    max_width = Redraws()
     def __init__(self, pos, text, max_width=None):
         super().__init__(pos)
         self.width, self.height = 0, 0
@@ -55,6 +70,7 @@ class Text(PositionedWidget):
             self._Write(x, y+idx, line)
 
 class Button(Text):
+    pressing = Redraws()
     def __init__(self, pos, text, callback, max_width=None):
         super().__init__(pos, text, max_width)
         self.callback = callback
@@ -87,7 +103,8 @@ class Button(Text):
                     self.pressing = True
 
 class TextInput(PositionedWidget):
-    FILLER = '⓿'
+    FILLER = '⓿' # Where the cursor gets drawn
+    placeholder = Redraws()
     def __init__(self, 
                  pos, 
                  max_width=None, 
@@ -97,7 +114,8 @@ class TextInput(PositionedWidget):
                  onenter=None, 
                  weight_lr=0.5, 
                  placeholder='', 
-                 start=''
+                 start='',
+                 scroll=False
         ):
         super().__init__(pos)
         self.max_width = max_width
@@ -107,24 +125,88 @@ class TextInput(PositionedWidget):
         self.weight = weight_lr
         self.multiline = multiline
         self.onenter = onenter
+        self.scroll = scroll # Whether the text can be longer than fits, scrolling to follow the cursor (otherwise it gets cut down to max_width*max_height)
         self.text = start
-        self.cursor = None
         self.width, self.height = 0, 0
     
+    @property
+    def text(self):
+        return str(self.buffer)
+    
+    @text.setter
+    def text(self, text):
+        self.buffer = GapBuffer(text)
+        self.top = (0, 0) # The (line, row in the line) at the top of the view
+        self.invalidate()
+    
+    def insert(self, text):
+        """Inserts text (e.g. a paste) at the cursor"""
+        self.buffer.insert(text)
+        if not self.scroll and self.max_width is not None and self.max_height is not None:
+            self.buffer.truncate(self.max_width*self.max_height)
+        self.invalidate()
+    
+    def _rows(self, line, focus):
+        """Lays out one line of the text into rows, with the cursor in it if it's there"""
+        buf = self.buffer
+        start = buf.lineStart(line)
+        end = buf.lineStart(line+1)-1 if line+1 < buf.lineCount() else len(buf)
+        if focus and buf.line() == line:
+            return findLines(buf.text(start, buf.cursor)+self.FILLER+buf.text(buf.cursor, end), self.max_width)
+        return findLines(buf.text(start, end), self.max_width)
+    
+    def _above(self, line, row, n, stop):
+        """Gets the (line, row) n rows above a row, or None if that's above line `stop`"""
+        while n > row:
+            n -= row+1
+            line -= 1
+            if line < 0:
+                return (0, 0)
+            if line < stop:
+                return None
+            row = len(self._rows(line, False))-1
+        return (line, row-n)
+    
+    def _view(self, focus):
+        """Gets the rows in view, scrolling so the cursor stays in it. Only the lines in (or just above) the view get laid out."""
+        buf = self.buffer
+        top = self.top
+        if top[0] >= buf.lineCount(): # The text got shorter
+            top = (buf.lineCount()-1, 0)
+        if focus:
+            line = buf.line()
+            rows = self._rows(line, focus)
+            cursor = (line, next((idx for idx, r in enumerate(rows) if self.FILLER in str(r)), 0))
+            if cursor < top:
+                top = cursor
+            else:
+                highest = self._above(*cursor, self.max_height-1, top[0])
+                if highest is not None and highest > top:
+                    top = highest
+        self.top = top
+        line, row = top
+        lines = []
+        while len(lines) < self.max_height and line < buf.lineCount():
+            lines.extend(self._rows(line, focus)[row:])
+            line, row = line+1, 0
+        return lines[:self.max_height]
+    
     def draw(self, focus):
-        txt = self.text
-        if not focus:
-            txt = txt.replace(self.FILLER, '')
-        if txt == '':
+        buf = self.buffer
+        if len(buf) == 0 and not focus:
             if self.placeholder != '':
                 lines = [f'\033[90m{i}\033[39m' for i in findLines(self.placeholder, self.max_width)]
             else:
                 lines = [Row('_')]
+        elif self.max_height is not None:
+            lines = self._view(focus)
+        elif focus:
+            lines = findLines(buf.text(0, buf.cursor)+self.FILLER+buf.text(buf.cursor), self.max_width)
         else:
-            lines = findLines(txt, self.max_width)
+            lines = findLines(str(buf), self.max_width)
         if self.show_lines and self.max_width is not None:
             # '\033[90m_\033[0m'
-            nlines = lines[:self.max_height]
+            nlines = list(lines[:self.max_height])
             if self.max_height is not None:
                 nlines += [Row() for _ in range(self.max_height-len(nlines))]
             for idx, ln in enumerate(nlines):
@@ -147,160 +229,111 @@ class TextInput(PositionedWidget):
         self.width = max(len(i) for i in nlines)
         self.height = len(nlines)
         x, y = self.pos()
-        tme = math.floor(time.time()%1.5)
+        tme = self.API.blink(self.invalidate) if focus else 0 # The cursor is only shown when focussed
         for idx, ln in enumerate(nlines):
             self._Write(x, y+idx, str(ln).replace(self.FILLER, ['\033[7m_\033[27m', ' '][tme]))
     
     def update(self, focus):
-        if self.FILLER not in self.text:
-            self.text += self.FILLER
+        if not focus:
+            return
+        old = (self.buffer, self.buffer.changes)
         for ev in self.API.events:
-            if focus:
-                change_now = False
-                if ev.state == 1:
-                    if ev == 'UP':
-                        if self.max_width is None:
-                            self.text = self.FILLER+self.text.replace(self.FILLER, '')
-                        else:
-                            self.text = self.text[:max(self.text.index(self.FILLER)-self.max_width, 0)].replace(self.FILLER, '')+\
-                                             self.FILLER+\
-                                             self.text[max(self.text.index(self.FILLER)-self.max_width, 0):].replace(self.FILLER, '')
-                    elif ev == 'DOWN':
-                        if self.max_width is None:
-                            self.text = self.text.replace(self.FILLER, '')+self.FILLER
-                        else:
-                            self.text = self.text[:self.text.index(self.FILLER)+self.max_width+1].replace(self.FILLER, '')+\
-                                             self.FILLER+\
-                                             self.text[self.text.index(self.FILLER)+self.max_width+1:].replace(self.FILLER, '')
-                    elif ev == 'LEFT':
-                        self.text = self.text[:max(self.text.index(self.FILLER)-1, 0)].replace(self.FILLER, '')+\
-                                         self.FILLER+\
-                                         self.text[max(self.text.index(self.FILLER)-1, 0):].replace(self.FILLER, '')
-                    elif ev == 'RIGHT':
-                        self.text = self.text[:self.text.index(self.FILLER)+2].replace(self.FILLER, '')+\
-                                         self.FILLER+\
-                                         self.text[self.text.index(self.FILLER)+2:].replace(self.FILLER, '')
-                if ev.state == 1 or (ev.heldFor > 0.8 and ev.heldFrames % 4 == 0):
-                    if ev == 'BACKSPACE':
-                        self.text = self.text[:self.text.index(self.FILLER)-1].replace(self.FILLER, '')+\
-                                         self.FILLER+\
-                                         self.text[self.text.index(self.FILLER)+1:].replace(self.FILLER, '')
-                        change_now = True
-                    elif ev == 'DELETE':
-                        self.text = self.text[:self.text.index(self.FILLER)].replace(self.FILLER, '')+\
-                                         self.FILLER+\
-                                         self.text[self.text.index(self.FILLER)+2:].replace(self.FILLER, '')
-                        change_now = True
-                    elif ev == 'ENTER':
-                        if self.multiline:
-                            self.text = self.text[:self.text.index(self.FILLER)].replace(self.FILLER, '')+\
-                                             '\n'+\
-                                             self.FILLER+\
-                                             self.text[self.text.index(self.FILLER)+1:].replace(self.FILLER, '')
-                        if self.onenter is not None:
-                            self.onenter()
-                    elif ev.unicode is not None:
-                        self.text = self.text[:self.text.index(self.FILLER)].replace(self.FILLER, '')+\
-                                         ev.unicode+\
-                                         self.FILLER+\
-                                         self.text[self.text.index(self.FILLER)+1:].replace(self.FILLER, '')
-                        change_now = True
-                if change_now:
-                    if self.FILLER not in self.text:
-                        self.text = self.text + self.FILLER
-                    if self.max_width is not None and self.max_height is not None:
-                        self.text = self.text[:self.max_width*self.max_height+1]
+            buf = self.buffer # onenter could have set the text
+            if ev.state == 1:
+                if ev == 'UP':
+                    buf.moveTo(0 if self.max_width is None else buf.cursor-self.max_width)
+                elif ev == 'DOWN':
+                    buf.moveTo(len(buf) if self.max_width is None else buf.cursor+self.max_width)
+                elif ev == 'LEFT':
+                    buf.moveTo(buf.cursor-1)
+                elif ev == 'RIGHT':
+                    buf.moveTo(buf.cursor+1)
+            for _ in range(ev.presses): # Once per press or repeat
+                if ev == 'BACKSPACE':
+                    buf.backspace()
+                elif ev == 'DELETE':
+                    buf.delete()
+                elif ev == 'ENTER':
+                    if self.multiline:
+                        self.insert('\n')
+                    if self.onenter is not None:
+                        self.onenter()
+                elif ev == 'ctrl+V':
+                    if Clipboard.CLIP:
+                        self.insert(Clipboard.read())
+                elif ev.unicode is not None:
+                    self.insert(ev.unicode)
+        if (self.buffer, self.buffer.changes) != old:
+            self.invalidate()
 
 class Terminal(PositionedWidget):
+    MAX_READ = 1 << 16 # The most output to take in each frame, so a command that never stops printing can't stall the OS
+    RING_SIZE = 1 << 20 # How much output can be waiting before the command has to wait for it to be taken
+    JUMP_THRESHOLD = 1 << 18 # When more output than this is waiting, jump scroll through as much as can be done in JUMP_TIME secs
+    JUMP_TIME = 0.02
+    mux = None # The PtyMux doing the I/O for every terminal, started with the first one
     def __init__(self, pos, cmd, width=50, height=10):
         self.width = width
         self.height = height
-        
-        self.master_fd = None
-        self.child_pid = None
-        self.orig_stdin_attrs = None
+        self.focus = False
 
         self.Tscreen = TerminalScreen(width, height)
+        self.decoder = codecs.getincrementaldecoder('utf-8')('replace') # Characters can be split between reads
 
-        self.updateQ = Queue()
-        self.displQ = Queue()
-        self.thread = Process(target=self.process, args=(self.updateQ, self.displQ, sys.stdin.fileno(), cmd, height, width), daemon=True)
-        self.thread.start()
+        self.ring = ByteRing(self.RING_SIZE)
+        if Terminal.mux is None:
+            Terminal.mux = PtyMux(self.API.sched.wake)
+        self.pty = Terminal.mux.open(cmd, width, height, self.ring)
+        self.rate = stats.rate(f'Terminal {self.pty.proc.pid} output')
     
         super().__init__(pos)
     
-    @staticmethod
-    def process(updQ: Queue, dispQ: Queue, stdinFileNo, cmd, height, width):
-        # Vars
-        focus = False
-
-        # Create pseudo-terminal
-        master_fd, slave_fd = pty.openpty()
-        winsize = struct.pack("HHHH", height, width, 0, 0)
-        fcntl.ioctl(slave_fd, termios.TIOCSWINSZ, winsize)
-
-        pid = os.fork()
-        if pid == 0:  # Child process
-            # Child process: create new session, connect stdio to slave_fd, and exec the shell.
-            os.close(master_fd)
-            os.setsid()
-            os.dup2(slave_fd, 0)  # stdin
-            os.dup2(slave_fd, 1)  # stdout
-            os.dup2(slave_fd, 2)  # stderr
-            os.execlp(cmd, cmd, "-i") # This blocks forever when successful
-        else:
-            os.close(slave_fd)
-            while True:
-                try:
-                    typ, dat = updQ.get_nowait()
-                    if typ == 1:
-                        focus = dat
-                    elif typ == 2:
-                        width, height = dat
-                        winsize = struct.pack("HHHH", height, width, 0, 0)
-                        fcntl.ioctl(master_fd, termios.TIOCSWINSZ, winsize)
-                except Empty:
-                    pass
-                ls = [master_fd]
-                if focus:
-                    ls.append(stdinFileNo)
-                rlist, _, _ = select.select(ls, [], [], 0.1)
-                for fd in rlist:
-                    if fd == master_fd:
-                        # Read data from the pseudo-terminal.
-                        try:
-                            data = os.read(master_fd, 1024)
-                        except OSError:
-                            return
-                        if not data:
-                            return
-                        # Feed the data to pyte to update the virtual screen.
-                        dispQ.put(data.decode())
-                    elif fd == stdinFileNo:
-                        # Read key input from stdin.
-                        key_data = os.read(stdinFileNo, 1024)
-                        if key_data:
-                            os.write(master_fd, key_data)
-    
     def resize(self, width, height):
-        if self.width == width or self.height == height:
+        if self.width == width and self.height == height:
             return
-        self.updateQ.put((2, (width, height)))
-        self.Tscreen.width, self.Tscreen.height = width, height
+        if self.pty is not None:
+            self.pty.resize(width, height)
+        self.Tscreen.Resize(width, height)
         self.width, self.height = width, height
+        self.invalidate()
+    
+    def close(self):
+        """Hangs up on the command"""
+        if self.pty is not None:
+            self.pty.close()
 
     def update(self, focus):
-        self.updateQ.put((1, focus))
-        try:
-            txt = self.displQ.get_nowait()
-            self.Tscreen.WriteAtCur(txt.replace('\r\n', '\n'))
-        except Empty:
-            pass
+        if self.pty is None:
+            return
+        if focus != self.focus:
+            self.pty.focus(focus)
+            self.focus = focus
+            self.invalidate()
+        closed = self.ring.closed # Checked first, so nothing written just before closing gets missed
+        jump = len(self.ring) > self.JUMP_THRESHOLD
+        end = time.perf_counter()+self.JUMP_TIME
+        while True:
+            data = self.ring.read(self.MAX_READ)
+            if not data:
+                break
+            self.rate.add(len(data))
+            self.invalidate()
+            if jump: # Only where it ends up gets drawn, so skip the lines that would just pass through the screen
+                self.Tscreen.WriteJumping(self.decoder.decode(data))
+                if time.perf_counter() < end:
+                    continue
+            else:
+                self.Tscreen.WriteAtCur(self.decoder.decode(data))
+            break
+        self.pty.resume()
+        if len(self.ring):
+            self.API.sched.invalidate() # There's still more to get through next frame
+        elif closed:
+            self.pty = None
     
     def draw(self, focus):
         x, y = self.pos()
-        for y2, ln in self.Tscreen.screen.items():
-            self._Write(x+1, y+y2+1, str(ln))
-        if focus and math.floor(time.time()%1.5) == 0:
+        self._Screen.Blit(self.Tscreen, x+1, y+1)
+        if focus and self.Tscreen.cursorVisible and self.API.blink(self.invalidate) == 0:
             x2, y2 = x+self.Tscreen.cursor[0]+1, y+self.Tscreen.cursor[1]+1
             self._Write(x2, y2, f'\033[7m{self._Screen.Get(x2, y2)}\033[27m')
@@ -0,0 +1,36 @@
+from evdev import ecodes
+from lib.IO import KbdInp, Key, KeyRepeat, Mods
+
+class FakeKbd(KbdInp):
+    """Gives out a list of batches of key events in place of the real keyboard"""
+    def __init__(self, batches):
+        self.events = {}
+        self.repeat = KeyRepeat()
+        self.sched = None
+        self._deferred = []
+        self._mods = Mods(0)
+        self.batches = list(batches)
+
+    def _recv(self):
+        return self.batches.pop(0) if self.batches else []
+
+def test_tap_within_one_frame():
+    A = ecodes.KEY_A
+    kbd = FakeKbd([[Key(A, 1, Mods(0)), Key(A, 0, Mods(0))]])
+    evs = kbd.handleQueue()
+    assert [(ev.scancode, ev.state, ev.presses) for ev in evs] == [(A, 1, 1)]
+    evs = kbd.handleQueue()
+    assert [(ev.scancode, ev.state, ev.presses) for ev in evs] == [(A, 0, 0)]
+    assert kbd.handleQueue() == []
+
+def test_mods_change_while_held():
+    A, SHIFT = ecodes.KEY_A, ecodes.KEY_LEFTSHIFT
+    kbd = FakeKbd([[Key(A, 1, Mods(0))], [Key(SHIFT, 1, Mods(0))], [Key(A, 2, Mods.SHIFT)], [Key(SHIFT, 0, Mods(0))]])
+    kbd.handleQueue()
+    assert kbd.events[A].unicode == 'a'
+    kbd.handleQueue()
+    assert kbd.events[A].chord.mods == Mods.SHIFT and kbd.events[A].unicode == 'A'
+    kbd.handleQueue()
+    assert kbd.events[A].state == 2 and kbd.events[A].unicode == 'A'
+    kbd.handleQueue()
+    assert kbd.events[A].chord.mods == Mods(0) and kbd.events[A].unicode == 'a'
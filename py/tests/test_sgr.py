@@ -0,0 +1,11 @@
+from lib import sgr
+
+def test_pens_stay_bounded_for_colour_cycling(monkeypatch):
+    monkeypatch.setattr(sgr, '_MAX_PENS', len(sgr._PENS)+100)
+    style = sgr.apply(sgr.DEFAULT, '\033[38;5;196m')
+    for i in range(5000):
+        style = sgr.apply(style, f'\033[1;38;2;{255-i%256};{i%7};{(i*3)%256}m')
+        assert sgr.pen(style)[0] & 1 # Still bold, even once the colours can't be kept
+    assert len(sgr._PENS) <= sgr._MAX_PENS+256
+    # Once it's full, a truecolour gets rounded to a 256 colour pen that's already there
+    assert sgr.apply(sgr.DEFAULT, '\033[38;2;250;0;0m') == sgr.apply(sgr.DEFAULT, '\033[38;5;196m')